@@ -0,0 +1,76 @@
+import io
+import math
+from typing import Any, Iterable, Iterator, Sequence
+
+BULK_METHODS = ("values", "copy")
+
+# Characters that must be escaped in COPY's text format.
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_field(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class CopyRowStream(io.RawIOBase):
+    """
+    Read-only file that renders rows in COPY text format on demand.
+
+    `copy_expert` pulls it in fixed-size reads, so only one read's worth of
+    encoded rows is held at a time instead of the whole payload.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Any]]) -> None:
+        self._rows: Iterator[Sequence[Any]] = iter(rows)
+        self._pending = bytearray()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self._pending) < len(buffer):
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._pending += ("\t".join(_copy_field(value) for value in row) + "\n").encode("utf-8")
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        del self._pending[:size]
+        return size
+
+
+def insert_rows(
+    cursor,
+    table: str,
+    columns: Sequence[str],
+    rows: Sequence[Sequence[Any]],
+    batch_size: int = 1000,
+    method: str = "values",
+) -> int:
+    """
+    Insert all rows on the caller's cursor and return the number of statements sent.
+
+    "values" sends multi-row INSERTs of `batch_size` rows through
+    `execute_values`; "copy" streams every row in a single COPY FROM STDIN.
+    Both run inside the caller's transaction, so a failure still rolls back
+    every row.
+    """
+    column_list = ", ".join(columns)
+    if method == "copy":
+        cursor.copy_expert(
+            f"COPY {table} ({column_list}) FROM STDIN", CopyRowStream(rows), size=64 * 1024
+        )
+        return 1
+    if method != "values":
+        raise ValueError(f"Unsupported bulk insert method '{method}'; use one of {BULK_METHODS}.")
+    from psycopg2.extras import execute_values
+
+    execute_values(
+        cursor,
+        f"INSERT INTO {table} ({column_list}) VALUES %s",
+        rows,
+        page_size=batch_size,
+    )
+    return math.ceil(len(rows) / batch_size)
@@ -1,13 +1,22 @@
 import json
 import logging
 import os
-import psycopg2
 import azure.functions as func
 
+from bulk_insert import insert_rows
+from perf_metrics import instrument_route, register_metrics_route, stage
+from pg_pool import get_pool, pool_stats
+
+# Rows per multi-row INSERT, and "values" (execute_values) or "copy" (COPY FROM STDIN).
+PG_INSERT_BATCH_SIZE = int(os.getenv("PG_INSERT_BATCH_SIZE", "1000"))
+PG_BULK_INSERT_METHOD = os.getenv("PG_BULK_INSERT_METHOD", "values").lower()
+
 app = func.FunctionApp()
+register_metrics_route(app)
 
 @app.function_name(name="transaction-demo")
 @app.route(route="transaction-demo", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+@instrument_route("transaction-demo")
 def transaction_demo(req: func.HttpRequest) -> func.HttpResponse:
     try:
         body = req.get_json()
@@ -20,36 +29,44 @@ def transaction_demo(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        conn = psycopg2.connect(
-            host=os.environ["PG_HOST"],
-            database=os.environ["PG_DB"],
-            user=os.environ["PG_USER"],
-            password=os.environ["PG_PASSWORD"],
-            port=os.environ["PG_PORT"],
-            sslmode="require"
-        )
-
-        conn.autocommit = False
-        cursor = conn.cursor()
-
+        # Validate everything first so a bad record never opens a transaction.
+        rows = []
         for record in records:
             if "email" not in record:
                 raise Exception("Validation failed: email missing")
+            rows.append((record["email"], record.get("message")))
 
-            cursor.execute(
-                """
-                INSERT INTO logicapp.messages (email, message)
-                VALUES (%s, %s)
-                """,
-                (record["email"], record.get("message"))
-            )
+        # Connections come from a pool shared by every invocation on this worker.
+        with stage("transaction-demo", "db_write") as measurement, get_pool().connection() as conn:
+            conn.autocommit = False
+            cursor = conn.cursor()
+
+            try:
+                # One transaction: multi-row INSERTs of PG_INSERT_BATCH_SIZE rows (or a single COPY).
+                statements = insert_rows(
+                    cursor,
+                    "logicapp.messages",
+                    ("email", "message"),
+                    rows,
+                    batch_size=PG_INSERT_BATCH_SIZE,
+                    method=PG_BULK_INSERT_METHOD
+                )
 
-        conn.commit()
+                conn.commit()
+                measurement.add(rows=len(rows))
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                cursor.close()
 
         return func.HttpResponse(
             json.dumps({
                 "status": "committed",
-                "count": len(records)
+                "count": len(records),
+                "statements": statements,
+                "pool": pool_stats()
             }),
             status_code=200,
             mimetype="application/json"
@@ -58,9 +75,6 @@ def transaction_demo(req: func.HttpRequest) -> func.HttpResponse:
     except Exception as e:
         logging.error(f"Transaction failed: {str(e)}")
 
-        if "conn" in locals():
-            conn.rollback()
-
         return func.HttpResponse(
             json.dumps({
                 "status": "rolled_back",
@@ -68,10 +82,4 @@ def transaction_demo(req: func.HttpRequest) -> func.HttpResponse:
             }),
             status_code=500,
             mimetype="application/json"
-        )
-
-    finally:
-        if "cursor" in locals():
-            cursor.close()
-        if "conn" in locals():
-            conn.close()
\ No newline at end of file
+        )
\ No newline at end of file
@@ -0,0 +1,42 @@
+import hashlib
+import json
+from typing import Any, List, Optional, Sequence
+
+# One row per committed chunk, written in the same transaction as the chunk's data.
+LEDGER_TABLE = "logicapp.retry_chunks"
+
+
+def request_key(records: Sequence[Any], scope: str, supplied: Optional[str] = None) -> str:
+    """
+    Stable key for a request's records.
+
+    Callers should send an `Idempotency-Key` header (`supplied`). Without one
+    the key is the SHA-256 of `scope` (the caller's run, or the invocation)
+    and the records, so retries of that call map to the same chunk keys while
+    the same records sent by another call are inserted again.
+    """
+    if supplied:
+        return str(supplied)
+    payload = json.dumps({"scope": scope, "records": records}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def split_chunks(rows: Sequence[Any], chunk_size: int) -> List[Sequence[Any]]:
+    return [rows[start : start + chunk_size] for start in range(0, len(rows), chunk_size)]
+
+
+def claim_chunk(cursor, chunk_key: str, row_count: int) -> bool:
+    """
+    Record the chunk in the ledger inside the current transaction.
+
+    Returns False when the chunk was already committed by an earlier attempt
+    or invocation; the caller then skips it. Because the ledger row commits
+    or rolls back together with the chunk's data, a chunk is written exactly
+    once no matter how often it is retried.
+    """
+    cursor.execute(
+        f"INSERT INTO {LEDGER_TABLE} (idempotency_key, row_count) VALUES (%s, %s) "
+        "ON CONFLICT (idempotency_key) DO NOTHING",
+        (chunk_key, row_count),
+    )
+    return cursor.rowcount == 1
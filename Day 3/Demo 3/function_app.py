@@ -1,101 +1,271 @@
 import json
 import logging
+import math
 import os
-import time
-from typing import Any, Dict, Iterable
+import threading
+import uuid
+from functools import lru_cache
+from typing import Optional, Tuple
 
 import azure.functions as func
-import psycopg2
-from psycopg2 import OperationalError, errors
 
+from bulk_insert import CopyRowStream, insert_rows
+from chunked_commit import claim_chunk, request_key, split_chunks
+from perf_metrics import instrument_route, register_metrics_route, stage
+from pg_pool import get_pool, pool_stats
 from retry_policy import RetryPolicyBuilder
-
-RETRYABLE_ERRORS: Iterable[type[BaseException]] = (
-    OperationalError,
-    errors.SerializationFailure,
-    errors.DeadlockDetected,
-    errors.ConnectionException,
-    errors.AdminShutdown,
+from retry_scheduler import AsyncRetryScheduler, CircuitOpenError, build_scheduler
+from stream_ingest import (
+    INGEST_FORMATS,
+    blob_source,
+    body_source,
+    format_from_content_type,
+    iter_rows,
 )
 
+
+@lru_cache(maxsize=1)
+def retryable_errors() -> Tuple[type, ...]:
+    """Transient PostgreSQL errors worth retrying (imports psycopg2 on first use, not at cold start)."""
+    from psycopg2 import OperationalError, errors
+
+    return (
+        OperationalError,
+        errors.SerializationFailure,
+        errors.DeadlockDetected,
+        errors.ConnectionException,
+        errors.AdminShutdown,
+    )
+
+
+# Rows per multi-row INSERT, and "values" (execute_values) or "copy" (COPY FROM STDIN).
+PG_INSERT_BATCH_SIZE = int(os.getenv("PG_INSERT_BATCH_SIZE", "1000"))
+PG_BULK_INSERT_METHOD = os.getenv("PG_BULK_INSERT_METHOD", "values").lower()
+# Rows per independently committed chunk on the bulk route.
+PG_CHUNK_SIZE = int(os.getenv("PG_CHUNK_SIZE", "1000"))
+# Bytes of encoded rows handed to COPY per read; bounds the memory used by streaming ingestion.
+PG_COPY_BUFFER_SIZE = int(os.getenv("PG_COPY_BUFFER_SIZE", str(64 * 1024)))
+# Storage account the stream route may read blobUrl from, e.g. https://<account>.blob.core.windows.net (empty: disabled).
+INGEST_BLOB_ACCOUNT_URL = os.getenv("INGEST_BLOB_ACCOUNT_URL", "")
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 retry_builder = RetryPolicyBuilder(app)
 host_retry_enabled = retry_builder.enabled
 http_route = retry_builder.http_route
+register_metrics_route(app)
 
-def _connection_params() -> Dict[str, Any]:
-    return {
-        "host": os.environ["PG_HOST"],
-        "database": os.environ["PG_DB"],
-        "user": os.environ["PG_USER"],
-        "password": os.environ["PG_PASSWORD"],
-        "port": os.environ.get("PG_PORT", "5432"),
-        "sslmode": os.environ.get("PG_SSLMODE", "require"),
-        "connect_timeout": int(os.getenv("PG_CONNECT_TIMEOUT", "10")),
-    }
+_retry_scheduler: Optional[AsyncRetryScheduler] = None
+_retry_scheduler_lock = threading.Lock()
 
 
-def execute_with_retry(operation):
-    """Wrap a database action with exponential backoff retries."""
-
-    max_attempts = int(os.getenv("PG_ACTION_MAX_ATTEMPTS", "4"))
-    base_delay = float(os.getenv("PG_ACTION_BASE_DELAY_SECONDS", "1.5"))
-    cap_delay = float(os.getenv("PG_ACTION_MAX_DELAY_SECONDS", "15"))
-    attempt = 0
-
-    while attempt < max_attempts:
-        attempt += 1
-        try:
-            operation()
-            return attempt
-        except RETRYABLE_ERRORS as exc:
-            if attempt >= max_attempts:
-                logging.error("Retry attempts exhausted for PostgreSQL action.")
-                raise
-
-            sleep_for = min(base_delay * (2 ** (attempt - 1)), cap_delay)
-            logging.warning(
-                "Transient PostgreSQL error '%s' (attempt %s/%s). "
-                "Retrying in %.1f seconds.",
-                exc,
-                attempt,
-                max_attempts,
-                sleep_for,
-            )
-            time.sleep(sleep_for)
+def get_retry_scheduler() -> AsyncRetryScheduler:
+    """Process-wide scheduler, so the retry budget and circuit breaker are shared by every invocation."""
+    global _retry_scheduler
+    if _retry_scheduler is None:
+        with _retry_scheduler_lock:
+            if _retry_scheduler is None:
+                _retry_scheduler = build_scheduler(retryable_errors())
+    return _retry_scheduler
+
+
+async def execute_with_retry(operation, max_attempts: Optional[int] = None) -> int:
+    """
+    Run a blocking database action with non-blocking, jittered retries.
+
+    The action runs on a worker thread and the backoff is awaited, so waiting
+    invocations hold no thread. Retries draw on a process-wide retry budget,
+    and an open circuit breaker fails fast with CircuitOpenError.
+    """
+    return await get_retry_scheduler().run(operation, max_attempts)
+
+
+def _build_rows(records):
+    """Validate every record before touching the database and return the rows to insert."""
+    rows = []
+    for record in records:
+        if not isinstance(record, dict) or "email" not in record:
+            raise ValueError("Each record must include an email field.")
+        rows.append((record["email"], json.dumps(record)))
+    return rows
+
 
+async def insert_records(
+    records, simulate_transient_errors: int, max_attempts: Optional[int] = None, route: str = "pg-retry-demo"
+):
+    """
+    Insert rows into PostgreSQL, optionally simulating transient failures.
 
-def insert_records(records, simulate_transient_errors: int) -> None:
-    """Insert rows into PostgreSQL, optionally simulating transient failures."""
+    All rows go out in one transaction as multi-row INSERTs (or one COPY), so
+    10k records take a handful of round trips instead of 10k. Returns
+    (attempts, statements sent by the successful attempt).
+    """
 
+    rows = _build_rows(records)
     fault_tracker = {"count": 0}
+    statements = {"count": 0}
 
     def operation():
         if fault_tracker["count"] < simulate_transient_errors:
             fault_tracker["count"] += 1
+            from psycopg2 import OperationalError
+
             raise OperationalError("Simulated transient connection reset.")
 
-        conn = psycopg2.connect(**_connection_params())
+        # A connection that fails here is discarded by the pool, so the retry gets a fresh one.
+        with get_pool().connection() as conn:
+            with conn:
+                with conn.cursor() as cursor:
+                    # created_at defaults to NOW(), the transaction start time.
+                    statements["count"] = insert_rows(
+                        cursor,
+                        "logicapp.retry_messages",
+                        ("email", "payload"),
+                        rows,
+                        batch_size=PG_INSERT_BATCH_SIZE,
+                        method=PG_BULK_INSERT_METHOD,
+                    )
+
+    with stage(route, "db_write") as measurement:
+        attempts = await execute_with_retry(operation, max_attempts)
+        measurement.add(rows=len(rows))
+    return attempts, statements["count"]
+
+
+async def insert_records_chunked(
+    records,
+    simulate_transient_errors: int,
+    idempotency_key=None,
+    max_attempts: Optional[int] = None,
+    route: str = "pg-retry-demo-bulk",
+    request_scope: str = "",
+):
+    """
+    Insert rows in chunks of PG_CHUNK_SIZE, each committed in its own transaction.
+
+    Each chunk claims "<request key>:<chunk index>" in the ledger table in the
+    same transaction as its rows. A transient error therefore retries only the
+    chunk that failed, and a host-level retry of the whole invocation skips
+    the chunks that already committed. Simulated transient errors hit the last
+    chunk, after the earlier ones have committed.
+    """
+
+    rows = _build_rows(records)
+    key = request_key(records, request_scope, idempotency_key)
+    chunks = split_chunks(rows, PG_CHUNK_SIZE)
+    fault_tracker = {"count": 0}
+    summary = {
+        "requestKey": key,
+        "chunks": len(chunks),
+        "committedChunks": 0,
+        "skippedChunks": 0,
+        "insertedRows": 0,
+        "dbAttempts": 0,
+        "retriedChunks": [],
+    }
+
+    for index, chunk in enumerate(chunks):
+        outcome = {"claimed": False}
+
+        def operation(chunk=chunk, chunk_key=f"{key}:{index}", outcome=outcome, last=index == len(chunks) - 1):
+            if last and fault_tracker["count"] < simulate_transient_errors:
+                fault_tracker["count"] += 1
+                from psycopg2 import OperationalError
+
+                raise OperationalError("Simulated transient connection reset.")
+
+            with get_pool().connection() as conn:
+                with conn:
+                    with conn.cursor() as cursor:
+                        outcome["claimed"] = claim_chunk(cursor, chunk_key, len(chunk))
+                        if outcome["claimed"]:
+                            insert_rows(
+                                cursor,
+                                "logicapp.retry_messages",
+                                ("email", "payload"),
+                                chunk,
+                                batch_size=PG_INSERT_BATCH_SIZE,
+                                method=PG_BULK_INSERT_METHOD,
+                            )
+
+        with stage(route, "db_write") as measurement:
+            attempts = await execute_with_retry(operation, max_attempts)
+            if outcome["claimed"]:
+                measurement.add(rows=len(chunk))
+        summary["dbAttempts"] += attempts
+        if attempts > 1:
+            summary["retriedChunks"].append(index)
+        if outcome["claimed"]:
+            summary["committedChunks"] += 1
+            summary["insertedRows"] += len(chunk)
+        else:
+            summary["skippedChunks"] += 1
+
+    return summary
+
+
+async def copy_stream(
+    open_source, data_format: str, max_attempts: Optional[int] = None, route: str = "pg-retry-demo-stream"
+):
+    """
+    COPY records from a stream into logicapp.retry_messages; returns (attempts, rows).
+
+    Records are parsed and validated one at a time while PostgreSQL reads the
+    COPY data, so memory stays at about PG_COPY_BUFFER_SIZE no matter how
+    large the input is. Each attempt reopens the source and runs in a single
+    transaction, so a bad record or a dropped connection loads nothing.
+    """
+
+    counter = {"rows": 0}
+
+    def operation():
+        from psycopg2 import Error
 
-        try:
+        counter["rows"] = 0
+        bad_records = []
+        with get_pool().connection() as conn, open_source() as stream:
             with conn:
                 with conn.cursor() as cursor:
-                    for record in records:
-                        if "email" not in record:
-                            raise ValueError("Each record must include an email field.")
-
-                        cursor.execute(
-                            """
-                            INSERT INTO logicapp.retry_messages (email, payload, created_at)
-                            VALUES (%s, %s, NOW())
-                            """,
-                            (record["email"], json.dumps(record)),
+                    try:
+                        cursor.copy_expert(
+                            "COPY logicapp.retry_messages (email, payload) FROM STDIN",
+                            CopyRowStream(iter_rows(stream, data_format, counter, bad_records)),
+                            size=PG_COPY_BUFFER_SIZE,
                         )
-        finally:
-            conn.close()
+                    except Error:
+                        # psycopg2 turns a ValueError from the row stream into QueryCanceled (an OperationalError);
+                        # surface the bad record instead, so it is neither retried nor counted by the breaker.
+                        if bad_records:
+                            raise bad_records[0] from None
+                        raise
+
+    with stage(route, "db_write") as measurement:
+        attempts = await execute_with_retry(operation, max_attempts)
+        measurement.add(rows=counter["rows"])
+    return attempts, counter["rows"]
+
+
+def _parse_stream_request(req: func.HttpRequest):
+    """Return (source factory, format, source kind) for an NDJSON/CSV body or a blob URL."""
+    data_format = (req.params.get("format") or format_from_content_type(req.headers.get("content-type", ""))).lower()
+    if data_format:
+        if data_format not in INGEST_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(INGEST_FORMATS)}.")
+        return body_source(req.get_body()), data_format, "body"
 
-    attempts = execute_with_retry(operation)
-    return attempts
+    try:
+        body = req.get_json()
+    except ValueError as exc:
+        raise ValueError(
+            "Send an NDJSON or CSV body (Content-Type application/x-ndjson or text/csv), "
+            "or JSON with a 'blobUrl'."
+        ) from exc
+    blob_url = body.get("blobUrl") if isinstance(body, dict) else None
+    if not blob_url:
+        raise ValueError("JSON requests must include a 'blobUrl'.")
+    data_format = str(body.get("format", "ndjson")).lower()
+    if data_format not in INGEST_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(INGEST_FORMATS)}.")
+    return blob_source(blob_url, INGEST_BLOB_ACCOUNT_URL), data_format, "blob"
 
 
 def _parse_request_payload(req: func.HttpRequest):
@@ -136,20 +306,76 @@ def _parse_request_payload(req: func.HttpRequest):
     return records, simulate_transient_errors, None
 
 
-def _handle_pg_retry(req: func.HttpRequest, mode: str) -> func.HttpResponse:
+def _circuit_open_response(exc: CircuitOpenError) -> func.HttpResponse:
+    # Returned rather than raised: a host-level retry into an open circuit would fail the same way.
+    return func.HttpResponse(
+        json.dumps({"status": "unavailable", "error": str(exc), **get_retry_scheduler().stats()}),
+        status_code=503,
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        mimetype="application/json",
+    )
+
+
+def _request_scope(req: func.HttpRequest, context: Optional[func.Context]) -> str:
+    """
+    Identify the call a request belongs to, for the default idempotency key.
+
+    Logic Apps send the same run ID and action name on every retry of an HTTP
+    action; other callers fall back to the function invocation ID.
+    """
+    run_id = req.headers.get("x-ms-workflow-run-id")
+    if run_id:
+        return f"{run_id}/{req.headers.get('x-ms-workflow-operation-name', '')}"
+    invocation_id = getattr(context, "invocation_id", None)
+    return str(invocation_id) if invocation_id else uuid.uuid4().hex
+
+
+async def _handle_pg_retry(
+    req: func.HttpRequest, context: Optional[func.Context], mode: str, route: str
+) -> func.HttpResponse:
     records, simulate_transient_errors, error_response = _parse_request_payload(req)
     if error_response:
         return error_response
 
+    max_attempts = retry_builder.action_attempts(context, get_retry_scheduler().max_attempts)
     try:
-        db_attempts = insert_records(records, simulate_transient_errors)
+        if mode == "bulk":
+            summary = await insert_records_chunked(
+                records,
+                simulate_transient_errors,
+                req.headers.get("idempotency-key"),
+                max_attempts,
+                route,
+                _request_scope(req, context),
+            )
+            response = {
+                "status": "success",
+                "inserted": summary.pop("insertedRows"),
+                "dbAttempts": summary.pop("dbAttempts"),
+                **summary,
+                "hostRetryConfigured": host_retry_enabled,
+                "mode": mode,
+                "pool": pool_stats(),
+                **get_retry_scheduler().stats(),
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                status_code=200,
+                mimetype="application/json",
+            )
+
+        db_attempts, statements = await insert_records(records, simulate_transient_errors, max_attempts, route)
 
         response = {
             "status": "success",
             "inserted": len(records),
             "dbAttempts": db_attempts,
+            "bulkMethod": PG_BULK_INSERT_METHOD,
+            "statements": statements,
             "hostRetryConfigured": host_retry_enabled,
             "mode": mode,
+            "pool": pool_stats(),
+            **get_retry_scheduler().stats(),
         }
         return func.HttpResponse(
             json.dumps(response),
@@ -157,7 +383,10 @@ def _handle_pg_retry(req: func.HttpRequest, mode: str) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    except RETRYABLE_ERRORS as exc:
+    except CircuitOpenError as exc:
+        return _circuit_open_response(exc)
+
+    except retryable_errors() as exc:
         logging.error("PostgreSQL action kept failing: %s", exc)
         raise  # triggers Azure Functions host-level retry
 
@@ -172,11 +401,66 @@ def _handle_pg_retry(req: func.HttpRequest, mode: str) -> func.HttpResponse:
 
 @app.function_name(name="pg-retry-demo")
 @http_route("pg-retry-demo", methods=["POST"])
-def pg_retry_demo(req: func.HttpRequest) -> func.HttpResponse:
-    return _handle_pg_retry(req, mode="single")
+@instrument_route("pg-retry-demo")
+async def pg_retry_demo(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
+    return await _handle_pg_retry(req, context, mode="single", route="pg-retry-demo")
+
+
+@app.function_name(name="pg-retry-demo-stream")
+@http_route("pg-retry-demo-stream", methods=["POST"])
+@instrument_route("pg-retry-demo-stream")
+async def pg_retry_demo_stream(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
+    try:
+        open_source, data_format, source = _parse_stream_request(req)
+    except ValueError as exc:
+        return func.HttpResponse(
+            json.dumps({"error": str(exc)}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    max_attempts = retry_builder.action_attempts(context, get_retry_scheduler().max_attempts)
+    try:
+        db_attempts, inserted = await copy_stream(open_source, data_format, max_attempts)
+    except CircuitOpenError as exc:
+        return _circuit_open_response(exc)
+    except retryable_errors() as exc:
+        logging.error("PostgreSQL action kept failing: %s", exc)
+        raise  # triggers Azure Functions host-level retry
+    except ValueError as exc:
+        return func.HttpResponse(
+            json.dumps({"status": "rolled_back", "error": str(exc)}),
+            status_code=400,
+            mimetype="application/json",
+        )
+    except Exception as exc:
+        logging.error("Non-retryable failure: %s", exc)
+        return func.HttpResponse(
+            json.dumps({"status": "failed", "error": str(exc)}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    response = {
+        "status": "success",
+        "inserted": inserted,
+        "dbAttempts": db_attempts,
+        "format": data_format,
+        "source": source,
+        "hostRetryConfigured": host_retry_enabled,
+        "mode": "stream",
+        "pool": pool_stats(),
+        **get_retry_scheduler().stats(),
+    }
+    return func.HttpResponse(
+        json.dumps(response),
+        status_code=200,
+        mimetype="application/json",
+    )
 
 
 @app.function_name(name="pg-retry-demo-bulk")
 @http_route("pg-retry-demo-bulk", methods=["POST"])
-def pg_retry_demo_bulk(req: func.HttpRequest) -> func.HttpResponse:
-    return _handle_pg_retry(req, mode="bulk")
+@instrument_route("pg-retry-demo-bulk")
+async def pg_retry_demo_bulk(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
+    return await _handle_pg_retry(req, context, mode="bulk", route="pg-retry-demo-bulk")
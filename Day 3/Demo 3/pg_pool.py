@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional
+
+# psycopg2 is imported when the first pool is created, keeping it off the cold-start path.
+
+
+def connection_params() -> Dict[str, Any]:
+    return {
+        "host": os.environ["PG_HOST"],
+        "database": os.environ["PG_DB"],
+        "user": os.environ["PG_USER"],
+        "password": os.environ["PG_PASSWORD"],
+        "port": os.environ.get("PG_PORT", "5432"),
+        "sslmode": os.environ.get("PG_SSLMODE", "require"),
+        "connect_timeout": int(os.getenv("PG_CONNECT_TIMEOUT", "10")),
+    }
+
+
+@lru_cache(maxsize=1)
+def _counting_pool_class() -> type:
+    from psycopg2.pool import ThreadedConnectionPool
+
+    class _CountingPool(ThreadedConnectionPool):
+        """ThreadedConnectionPool that counts the connections it opens and when each was last used."""
+
+        def __init__(self, *args, **kwargs) -> None:
+            self.opened = 0
+            self.last_used: Dict[int, float] = {}
+            super().__init__(*args, **kwargs)
+
+        def _connect(self, key=None):
+            conn = super()._connect(key)
+            self.opened += 1
+            self.last_used[id(conn)] = time.monotonic()
+            return conn
+
+    return _CountingPool
+
+
+def _connection_errors() -> tuple:
+    """Errors that mean a connection is unusable."""
+    from psycopg2 import InterfaceError, OperationalError
+
+    return (OperationalError, InterfaceError)
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of PostgreSQL connections.
+
+    Reusing connections across invocations saves the TCP + TLS + auth
+    handshake on every request. Checkout waits up to `timeout` seconds for a
+    free connection. A connection that sat idle for longer than
+    `health_check_after` seconds is pinged with `SELECT 1` first. Connections
+    that raise OperationalError/InterfaceError while in use are closed instead
+    of being returned to the pool.
+    """
+
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        health_check_after: float = 30.0,
+        timeout: float = 10.0,
+        **connect_kwargs: Any,
+    ) -> None:
+        self._pool = _counting_pool_class()(min_size, max_size, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._health_check_after = health_check_after
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkouts = 0
+        self.in_use = 0
+        self.discarded = 0
+        self.failed_health_checks = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle_for = time.monotonic() - self._pool.last_used.get(id(conn), 0.0)
+        if idle_for < self._health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except _connection_errors():
+            return False
+
+    def _discard(self, conn) -> None:
+        with self._lock:
+            self.discarded += 1
+            self._pool.last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _checkout(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self._timeout):
+            from psycopg2.pool import PoolError
+
+            raise PoolError(f"No PostgreSQL connection became free within {self._timeout} seconds.")
+        try:
+            # Every stale connection is replaced by a fresh one, so this ends once one passes.
+            while True:
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                with self._lock:
+                    self.failed_health_checks += 1
+                logging.warning("Discarding a pooled PostgreSQL connection that failed its health check.")
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return conn
+
+    def _release(self, conn, broken: bool) -> None:
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._pool.last_used[id(conn)] = time.monotonic()
+                # putconn rolls back any transaction the caller left open.
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a connection; it is returned (or discarded if broken) on exit."""
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except _connection_errors():
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                "inUse": self.in_use,
+                "idle": len(self._pool._pool),
+                "opened": self._pool.opened,
+                "checkouts": self.checkouts,
+                "discarded": self.discarded,
+                "failedHealthChecks": self.failed_health_checks,
+                "avgWaitMs": round(self.wait_seconds / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "maxWaitMs": round(self.max_wait_seconds * 1000, 2),
+            }
+
+    def close(self) -> None:
+        self._pool.closeall()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Create the pool on first use from the PG_* settings and share it for the life of the worker."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    min_size=int(os.getenv("PG_POOL_MIN_SIZE", "1")),
+                    max_size=int(os.getenv("PG_POOL_MAX_SIZE", "5")),
+                    health_check_after=float(os.getenv("PG_POOL_HEALTH_CHECK_SECONDS", "30")),
+                    timeout=float(os.getenv("PG_POOL_TIMEOUT_SECONDS", "10")),
+                    **connection_params(),
+                )
+    return _pool
+
+
+def pool_stats() -> Optional[Dict[str, Any]]:
+    """Metrics of the pool, or None when it has not been created yet."""
+    return _pool.stats() if _pool else None
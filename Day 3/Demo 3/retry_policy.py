@@ -34,6 +34,19 @@ class RetryPolicyBuilder:
 
         return self._app.route(route=route, methods=methods)
 
+    def action_attempts(self, context: Optional[func.Context], configured: int) -> int:
+        """
+        App-level attempts allowed for this execution.
+
+        The first execution gets the configured attempts. Host-level retries
+        get a single attempt each, so the two layers add up (configured + host
+        retries) instead of multiplying.
+        """
+        retry_context = getattr(context, "retry_context", None)
+        if not self._policy or retry_context is None or retry_context.retry_count == 0:
+            return configured
+        return 1
+
     def _build_policy(self) -> Optional[RetryPolicy]:
         if not (RetryPolicy and RetryStrategy):
             return None
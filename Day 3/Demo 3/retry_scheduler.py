@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+
+class CircuitOpenError(Exception):
+    """Raised without touching the database while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"PostgreSQL circuit is open; retry in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+def decorrelated_jitter(previous: float, base: float, cap: float) -> float:
+    """Next delay: random between base and 3x the previous delay, capped (the "decorrelated jitter" schedule)."""
+    return min(cap, random.uniform(base, max(base, previous * 3)))
+
+
+class RetryBudget:
+    """
+    Process-wide token bucket for retries.
+
+    Every retry spends one token and every success earns `success_credit`
+    back. When the database keeps failing the bucket drains and requests stop
+    retrying, instead of every request multiplying the load with its own
+    retries.
+    """
+
+    def __init__(self, max_tokens: float = 10.0, success_credit: float = 0.1) -> None:
+        self.max_tokens = max_tokens
+        self.success_credit = success_credit
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def credit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.success_credit)
+
+
+class CircuitBreaker:
+    """
+    Opens when the error rate over the last `window` seconds reaches `error_rate`.
+
+    While open every call fails fast with CircuitOpenError. After `cooldown`
+    seconds a single probe call is let through; its outcome closes the
+    circuit or opens it again.
+    """
+
+    def __init__(
+        self,
+        error_rate: float = 0.5,
+        min_calls: int = 10,
+        window: float = 30.0,
+        cooldown: float = 30.0,
+    ) -> None:
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self._probe_in_flight:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self.state = "half_open"
+            self._probe_in_flight = True
+
+    def record(self, success: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+                self._outcomes.clear()
+                if success:
+                    self.state = "closed"
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, success))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate:
+                self._open(now)
+
+    def abandon(self) -> None:
+        """Forget a call that ended without an outcome (it was cancelled); a half-open probe may be retried."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self, now: float) -> None:
+        logging.error("Opening the PostgreSQL circuit for %.0f seconds.", self.cooldown)
+        self.state = "open"
+        self._opened_at = now
+        self._outcomes.clear()
+
+
+class AsyncRetryScheduler:
+    """
+    Retries blocking database actions without blocking the worker.
+
+    The action runs in a thread (`asyncio.to_thread`) and the backoff is an
+    `await asyncio.sleep`, so an invocation waiting to retry holds no thread.
+    Delays follow decorrelated jitter so instances that failed together do
+    not retry together. Retries draw on the shared RetryBudget and every
+    attempt goes through the CircuitBreaker.
+    """
+
+    def __init__(
+        self,
+        retryable: Iterable[type],
+        max_attempts: int,
+        base_delay: float,
+        cap_delay: float,
+        budget: RetryBudget,
+        breaker: CircuitBreaker,
+    ) -> None:
+        self.retryable = tuple(retryable)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.cap_delay = cap_delay
+        self.budget = budget
+        self.breaker = breaker
+
+    async def run(self, operation: Callable[[], Any], max_attempts: Optional[int] = None) -> int:
+        """Run `operation` until it succeeds; returns the number of attempts it took."""
+        max_attempts = max_attempts or self.max_attempts
+        delay = self.base_delay
+        attempt = 0
+
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            try:
+                await asyncio.to_thread(operation)
+            except self.retryable as exc:
+                self.breaker.record(False)
+                if attempt >= max_attempts:
+                    logging.error("Retry attempts exhausted for PostgreSQL action.")
+                    raise
+                if not self.budget.try_spend():
+                    logging.error("Retry budget exhausted; not retrying PostgreSQL action.")
+                    raise
+
+                delay = decorrelated_jitter(delay, self.base_delay, self.cap_delay)
+                logging.warning(
+                    "Transient PostgreSQL error '%s' (attempt %s/%s). Retrying in %.2f seconds.",
+                    exc,
+                    attempt,
+                    max_attempts,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # Not a connectivity problem (e.g. bad data): the database answered.
+                self.breaker.record(True)
+                raise
+            except BaseException:
+                # Cancelled (asyncio.CancelledError) or interrupted before an answer: nothing is known about the
+                # database, so the circuit keeps its state and a half-open circuit lets the next call probe.
+                self.breaker.abandon()
+                raise
+
+            self.breaker.record(True)
+            self.budget.credit()
+            return attempt
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "retryTokens": round(self.budget.tokens, 2),
+        }
+
+
+def build_scheduler(retryable: Iterable[type]) -> AsyncRetryScheduler:
+    """Scheduler configured from the PG_ACTION_*, PG_RETRY_BUDGET_* and PG_BREAKER_* settings."""
+    return AsyncRetryScheduler(
+        retryable,
+        max_attempts=int(os.getenv("PG_ACTION_MAX_ATTEMPTS", "4")),
+        base_delay=float(os.getenv("PG_ACTION_BASE_DELAY_SECONDS", "1.5")),
+        cap_delay=float(os.getenv("PG_ACTION_MAX_DELAY_SECONDS", "15")),
+        budget=RetryBudget(
+            max_tokens=float(os.getenv("PG_RETRY_BUDGET_TOKENS", "10")),
+            success_credit=float(os.getenv("PG_RETRY_BUDGET_SUCCESS_CREDIT", "0.1")),
+        ),
+        breaker=CircuitBreaker(
+            error_rate=float(os.getenv("PG_BREAKER_ERROR_RATE", "0.5")),
+            min_calls=int(os.getenv("PG_BREAKER_MIN_CALLS", "10")),
+            window=float(os.getenv("PG_BREAKER_WINDOW_SECONDS", "30")),
+            cooldown=float(os.getenv("PG_BREAKER_COOLDOWN_SECONDS", "30")),
+        ),
+    )
@@ -1,34 +1,69 @@
 import json
 import logging
 import os
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Tuple
 
 import azure.functions as func
-import psycopg2
-from psycopg2 import Error as PsycopgError
+
+from perf_metrics import instrument_route, register_metrics_route, stage
+from pg_pool import get_pool, pool_stats
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the standard library encoder.
+    orjson = None
+
+# Records per stored procedure call; every call runs in the same transaction.
+PG_PROC_CHUNK_SIZE = int(os.getenv("PG_PROC_CHUNK_SIZE", "500"))
+
+JSON_SERIALIZER = "orjson" if orjson else "json"
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+register_metrics_route(app)
 
 
-def _connection_params() -> Dict[str, Any]:
-    return {
-        "host": os.environ["PG_HOST"],
-        "database": os.environ["PG_DB"],
-        "user": os.environ["PG_USER"],
-        "password": os.environ["PG_PASSWORD"],
-        "port": os.environ.get("PG_PORT", "5432"),
-        "sslmode": os.environ.get("PG_SSLMODE", "require"),
-    }
+def _encode_records(records: List[Dict[str, Any]]) -> Tuple[str, int]:
+    """Compact JSON for the procedure parameter and its size in bytes on the wire."""
+    if orjson:
+        encoded = orjson.dumps(records)
+        return encoded.decode("utf-8"), len(encoded)
+    # ensure_ascii (the default) keeps one byte per character.
+    payload = json.dumps(records, separators=(",", ":"))
+    return payload, len(payload)
 
 
-def _call_insert_procedure(cursor, records: List[Dict[str, Any]]):
+def _call_insert_procedure(cursor, records: List[Dict[str, Any]], chunk_size: int) -> List[Dict[str, Any]]:
+    """
+    Call the procedure once per chunk of records on the caller's cursor.
+
+    Only one chunk's JSON exists at a time, on the client and on the server.
+    The caller owns the transaction, so a failing chunk still rolls back the
+    chunks before it. Returns rows, bytes and throughput per chunk.
+    """
     procedure_name = os.getenv("PG_INSERT_PROC", "logicapp.insert_messages_batch")
-    payload = json.dumps(records)
-    cursor.callproc(procedure_name, [payload])
+    chunks = []
+    for index, start in enumerate(range(0, len(records), chunk_size)):
+        chunk = records[start : start + chunk_size]
+        started = time.perf_counter()
+        payload, size = _encode_records(chunk)
+        cursor.callproc(procedure_name, [payload])
+        elapsed = time.perf_counter() - started
+        chunks.append(
+            {
+                "chunk": index,
+                "rows": len(chunk),
+                "bytes": size,
+                "seconds": round(elapsed, 4),
+                "rowsPerSecond": round(len(chunk) / elapsed, 1) if elapsed else None,
+            }
+        )
+    return chunks
 
 
 @app.function_name(name="stored-proc-rollback")
 @app.route(route="stored-proc-rollback", methods=["POST"])
+@instrument_route("stored-proc-rollback")
 def stored_proc_rollback(req: func.HttpRequest) -> func.HttpResponse:
     try:
         body = req.get_json()
@@ -53,20 +88,38 @@ def stored_proc_rollback(req: func.HttpRequest) -> func.HttpResponse:
 
     force_failure = bool(body.get("simulateFailure", False))
 
-    conn = None
-    try:
-        conn = psycopg2.connect(**_connection_params())
-        conn.autocommit = False
-
-        with conn.cursor() as cursor:
-            _call_insert_procedure(cursor, records)
+    chunk_size = body.get("chunkSize", PG_PROC_CHUNK_SIZE)
+    if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 1:
+        return func.HttpResponse(
+            json.dumps({"error": "chunkSize must be a positive integer."}),
+            status_code=400,
+            mimetype="application/json",
+        )
 
-            if force_failure:
-                raise RuntimeError(
-                    "simulateFailure=true triggered an exception after the stored procedure call."
-                )
+    # psycopg2 loads on the first database call rather than at cold start.
+    from psycopg2 import Error as PsycopgError
 
-        conn.commit()
+    started = time.perf_counter()
+    try:
+        with get_pool().connection() as conn:
+            conn.autocommit = False
+            try:
+                with conn.cursor() as cursor:
+                    with stage("stored-proc-rollback", "db_write") as measurement:
+                        chunks = _call_insert_procedure(cursor, records, chunk_size)
+                        measurement.add(sum(chunk["bytes"] for chunk in chunks), rows=len(records))
+
+                    if force_failure:
+                        raise RuntimeError(
+                            "simulateFailure=true triggered an exception after the stored procedure call."
+                        )
+
+                conn.commit()
+                elapsed = time.perf_counter() - started
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
 
         return func.HttpResponse(
             json.dumps(
@@ -76,6 +129,13 @@ def stored_proc_rollback(req: func.HttpRequest) -> func.HttpResponse:
                     "procedure": os.getenv(
                         "PG_INSERT_PROC", "logicapp.insert_messages_batch"
                     ),
+                    "chunkSize": chunk_size,
+                    "serializer": JSON_SERIALIZER,
+                    "bytesSent": sum(chunk["bytes"] for chunk in chunks),
+                    "seconds": round(elapsed, 4),
+                    "rowsPerSecond": round(len(records) / elapsed, 1) if elapsed else None,
+                    "chunks": chunks,
+                    "pool": pool_stats(),
                 }
             ),
             status_code=200,
@@ -84,8 +144,6 @@ def stored_proc_rollback(req: func.HttpRequest) -> func.HttpResponse:
 
     except PsycopgError as db_err:
         logging.error("Database error occurred: %s", db_err)
-        if conn:
-            conn.rollback()
         return func.HttpResponse(
             json.dumps({"status": "rolled_back", "error": str(db_err)}),
             status_code=500,
@@ -94,14 +152,8 @@ def stored_proc_rollback(req: func.HttpRequest) -> func.HttpResponse:
 
     except Exception as exc:
         logging.error("Unexpected error: %s", exc)
-        if conn:
-            conn.rollback()
         return func.HttpResponse(
             json.dumps({"status": "rolled_back", "error": str(exc)}),
             status_code=500,
             mimetype="application/json",
         )
-
-    finally:
-        if conn:
-            conn.close()
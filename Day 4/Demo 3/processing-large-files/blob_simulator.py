@@ -0,0 +1,170 @@
+"""
+In-memory stand-in for a block blob client with a simple throttling model.
+
+Use it to exercise the uploader (and the adaptive concurrency controller)
+offline:
+
+    python blob_simulator.py --size-mb 512 --bandwidth-mbps 200
+
+Each Put Block costs a fixed latency plus its share of a bandwidth that is
+split between in-flight requests. The account serves at most `capacity`
+requests at once; a request that finds no free slot is rejected and retried
+after `throttle_penalty` seconds, which is how the storage SDK's internal
+retry of a 503 ServerBusy response looks to the caller.
+"""
+
+import argparse
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+
+
+class InMemoryBlobClient:
+    def __init__(
+        self,
+        url: str = "https://simulated.blob.core.windows.net/uploads/blob",
+        base_latency: float = 0.02,
+        bandwidth: float = 100 * 1024 * 1024,
+        capacity: int = 16,
+        throttle_penalty: float = 0.25,
+        keep_data: bool = False,
+    ) -> None:
+        self.url = url
+        self.base_latency = base_latency
+        self.bandwidth = bandwidth
+        self.capacity = capacity
+        self.throttle_penalty = throttle_penalty
+        self.keep_data = keep_data
+        self.requests = 0
+        self.throttled = 0
+        self.peak_in_flight = 0
+        self.metadata: Optional[dict] = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._uncommitted: Dict[str, Tuple[int, bytes]] = {}
+        self._committed: List[Tuple[str, int, bytes]] = []
+
+    def _simulate_request(self, size: int) -> None:
+        with self._lock:
+            self.requests += 1
+        while not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.throttled += 1
+            time.sleep(self.throttle_penalty)
+        try:
+            with self._lock:
+                self._in_flight += 1
+                in_flight = self._in_flight
+                self.peak_in_flight = max(self.peak_in_flight, in_flight)
+            time.sleep(self.base_latency + size * in_flight / self.bandwidth)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def stage_block(self, block_id: str, data, length: Optional[int] = None, **kwargs) -> None:
+        content = data.read() if hasattr(data, "read") else bytes(data)
+        expected_md5 = kwargs.get("transactional_content_md5")
+        self._simulate_request(len(content))
+        if expected_md5 and hashlib.md5(content).digest() != expected_md5:
+            error = HttpResponseError(message="The MD5 value specified did not match.")
+            error.error_code = "Md5Mismatch"
+            raise error
+        with self._lock:
+            self._uncommitted[block_id] = (len(content), content if self.keep_data else b"")
+
+    def stage_block_from_url(self, block_id: str, source_url: str, source_offset: int = 0,
+                             source_length: Optional[int] = None, **kwargs) -> None:
+        self._simulate_request(0)
+        with self._lock:
+            self._uncommitted[block_id] = (source_length or 0, b"")
+
+    def get_block_list(self, block_list_type: str = "committed", **kwargs):
+        with self._lock:
+            committed = [self._block(block_id, size) for block_id, size, _ in self._committed]
+            uncommitted = [
+                self._block(block_id, size) for block_id, (size, _) in self._uncommitted.items()
+            ]
+        if block_list_type == "uncommitted":
+            return [], uncommitted
+        if block_list_type == "all":
+            return committed, uncommitted
+        return committed, []
+
+    def commit_block_list(self, block_list, content_settings=None, metadata=None, **kwargs) -> None:
+        self._simulate_request(0)
+        with self._lock:
+            committed = []
+            for block in block_list:
+                if block.id not in self._uncommitted:
+                    raise HttpResponseError(message=f"Block '{block.id}' is not staged.")
+                size, content = self._uncommitted[block.id]
+                committed.append((block.id, size, content))
+            self._committed = committed
+            self._uncommitted = {}
+            self.metadata = metadata
+
+    def delete_blob(self, **kwargs) -> None:
+        with self._lock:
+            if not self._committed and not self._uncommitted:
+                raise ResourceNotFoundError("The specified blob does not exist.")
+            self._committed = []
+            self._uncommitted = {}
+
+    def readall(self) -> bytes:
+        """Return the committed content (only populated with keep_data=True)."""
+        with self._lock:
+            return b"".join(content for _, _, content in self._committed)
+
+    @staticmethod
+    def _block(block_id: str, size: int) -> BlobBlock:
+        block = BlobBlock(block_id=block_id)
+        block.size = size
+        return block
+
+
+def _run(label: str, payload: dict, body: bytes, client_options: dict) -> None:
+    from function_app import _ingest
+
+    client = InMemoryBlobClient(**client_options)
+    started = time.perf_counter()
+    result = _ingest(client, payload, body)
+    elapsed = time.perf_counter() - started
+    mb = len(body) / (1024 * 1024)
+    concurrency = result["concurrency"]
+    if isinstance(concurrency, dict):
+        concurrency = f"adaptive {concurrency['min']}..{concurrency['max']} (final {concurrency['final']})"
+    print(
+        f"{label:<22} blocks={result['blockCount']:>5} blockSize={result['blockSize'] // 1024 // 1024}MB "
+        f"time={elapsed:6.2f}s throughput={mb / elapsed:8.1f}MB/s requests={client.requests} "
+        f"throttled={client.throttled} concurrency={concurrency}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the ingest action against a simulated blob.")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--bandwidth-mbps", type=float, default=200.0, help="Simulated bandwidth in MB/s.")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--capacity", type=int, default=12, help="In-flight requests before throttling.")
+    parser.add_argument("--fixed-concurrency", type=int, nargs="*", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    body = bytes(args.size_mb * 1024 * 1024)
+    client_options = {
+        "base_latency": args.latency_ms / 1000,
+        "bandwidth": args.bandwidth_mbps * 1024 * 1024,
+        "capacity": args.capacity,
+    }
+    for workers in args.fixed_concurrency:
+        _run(f"fixed x{workers}", {"maxConcurrency": workers}, body, client_options)
+    _run("adaptive", {"adaptive": True, "maxConcurrency": 32}, body, client_options)
+
+
+if __name__ == "__main__":
+    main()
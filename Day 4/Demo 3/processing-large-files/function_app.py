@@ -1,20 +1,56 @@
 import base64
 import binascii
+import hashlib
+import io
 import json
 import logging
 import os
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
 
 import azure.functions as func
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
-from azure.storage.blob import BlobBlock, BlobServiceClient, ContentSettings
+
+import perf_metrics
+from upload_planner import AdaptiveConcurrency, plan_upload
+from upload_sessions import build_session_store, new_session_id, parse_session_id
+
+if TYPE_CHECKING:
+    # The Storage SDK is imported on first use, keeping it off the cold-start path.
+    from azure.storage.blob import BlobBlock, BlobClient, BlobServiceClient, ContentSettings
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+perf_metrics.register_metrics_route(app)
 
-_blob_service_client: Optional[BlobServiceClient] = None
+_blob_service_client: "Optional[BlobServiceClient]" = None
+_session_store = None
+# Containers known to exist (name -> monotonic expiry) and reusable blob clients.
+_known_containers: Dict[str, float] = {}
+_blob_clients: "OrderedDict[Tuple[str, str], BlobClient]" = OrderedDict()
+_client_cache_lock = threading.Lock()
+CONTAINER_CACHE_TTL_SECONDS = float(os.getenv("CONTAINER_CACHE_TTL_SECONDS", "300"))
+BLOB_CLIENT_CACHE_SIZE = int(os.getenv("BLOB_CLIENT_CACHE_SIZE", "256"))
 RECOMMENDED_BLOCK_SIZE = 4 * 1024 * 1024  # 4 MB keeps Logic Apps stable.
 MAX_BLOCK_SIZE = 100 * 1024 * 1024  # REST API limit for Put Block.
 MAX_BLOCKS_PER_BLOB = 50_000
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+INGEST_PROGRESS_EVERY = 100  # Log progress every N staged blocks.
+# Adaptive mode aims for this many blocks and never runs more parallel stages than the cap.
+ADAPTIVE_TARGET_BLOCKS = int(os.getenv("ADAPTIVE_TARGET_BLOCKS", "2000"))
+ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("ADAPTIVE_MAX_CONCURRENCY", "32"))
+# Headers accepted as an alternative to query parameters on binary requests.
+BINARY_PARAM_HEADERS = {
+    "x-block-id": "blockId",
+    "x-block-number": "blockNumber",
+    "x-container-name": "containerName",
+    "x-blob-name": "blobName",
+    "x-session-id": "sessionId",
+    "content-md5": "contentMd5",
+}
+COMPOSITE_MD5_METADATA_KEY = "upload_md5_composite"
 
 
 def _get_storage_connection_string() -> str:
@@ -26,20 +62,65 @@ def _get_storage_connection_string() -> str:
     raise RuntimeError("No storage connection string configured.")
 
 
-def _get_blob_client(container_name: str, blob_name: str):
+def _get_blob_service_client() -> "BlobServiceClient":
     global _blob_service_client
     if _blob_service_client is None:
+        from azure.storage.blob import BlobServiceClient
+
         _blob_service_client = BlobServiceClient.from_connection_string(
             _get_storage_connection_string()
         )
+    return _blob_service_client
+
+
+def _get_session_store():
+    global _session_store
+    if _session_store is None:
+        _session_store = build_session_store()
+    return _session_store
+
+
+def _ensure_container(container_name: str, force: bool = False) -> None:
+    """Create the container unless this process saw it recently."""
+    with _client_cache_lock:
+        expiry = _known_containers.get(container_name)
+    if not force and expiry is not None and expiry > time.monotonic():
+        return
+
+    from azure.core.exceptions import ResourceExistsError
 
-    container_client = _blob_service_client.get_container_client(container_name)
     try:
-        container_client.create_container()
+        _get_blob_service_client().get_container_client(container_name).create_container()
     except ResourceExistsError:
         pass
+    with _client_cache_lock:
+        _known_containers[container_name] = time.monotonic() + CONTAINER_CACHE_TTL_SECONDS
 
-    return container_client.get_blob_client(blob_name)
+
+def _get_blob_client(container_name: str, blob_name: str, ensure_container: bool = False):
+    """
+    Return a cached blob client, creating the container only when asked.
+
+    Only `start` and `ingest` ensure the container; `stage` and `commit` skip
+    the extra round trip and rely on `start` having run (see the
+    ContainerNotFound fallback in the stage action).
+    """
+    if ensure_container:
+        _ensure_container(container_name)
+
+    key = (container_name, blob_name)
+    with _client_cache_lock:
+        client = _blob_clients.get(key)
+        if client is not None:
+            _blob_clients.move_to_end(key)
+            return client
+
+    client = _get_blob_service_client().get_blob_client(container_name, blob_name)
+    with _client_cache_lock:
+        _blob_clients[key] = client
+        while len(_blob_clients) > BLOB_CLIENT_CACHE_SIZE:
+            _blob_clients.popitem(last=False)
+    return client
 
 
 def _decode_chunk(encoded_chunk: str) -> bytes:
@@ -74,38 +155,466 @@ def _normalise_block_id(value) -> str:
         return base64.b64encode(formatted.encode()).decode()
 
 
+def _block_id_for_number(value) -> str:
+    """
+    Block ID for a blockNumber.
+
+    Digit strings count as numbers, as they do in binary mode; otherwise "12"
+    would pass for an already-encoded ID and the session could not match it.
+    """
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("blockNumber must be an integer.")
+    return _normalise_block_id(value)
+
+
 def _get_block_id_from_payload(payload: dict) -> str:
     if "blockId" in payload and payload["blockId"]:
         return _normalise_block_id(payload["blockId"])
     if "blockNumber" in payload:
-        return _normalise_block_id(payload["blockNumber"])
+        return _block_id_for_number(payload["blockNumber"])
     raise ValueError("Provide blockId or blockNumber for staging blocks.")
 
 
-def _normalise_block_list(blocks) -> List[BlobBlock]:
+def _block_number_from_id(block_id: str) -> Optional[int]:
+    """Recover the block number from an ID built by _normalise_block_id."""
+    try:
+        decoded = base64.b64decode(block_id, validate=True).decode()
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+    return int(decoded) if decoded.isdigit() else None
+
+
+def _session_block_list(blob_client, expected_count) -> List["BlobBlock"]:
+    """
+    Build the commit list from the service's uncommitted blocks.
+
+    The uncommitted block list is the source of truth, so stages that ran out
+    of order (or on other instances) are all picked up and sorted by number.
+    """
+    _, uncommitted = blob_client.get_block_list("uncommitted")
+    numbered = []
+    for block in uncommitted:
+        number = _block_number_from_id(block.id)
+        if number is None:
+            raise ValueError(
+                f"Staged block '{block.id}' has no block number; commit with an explicit blockList."
+            )
+        numbered.append((number, block.id))
+    numbered.sort()
+
+    if expected_count is not None:
+        expected_count = int(expected_count)
+        if len(numbered) != expected_count:
+            staged_numbers = {number for number, _ in numbered}
+            missing = [n for n in range(1, expected_count + 1) if n not in staged_numbers]
+            raise ValueError(
+                f"Expected {expected_count} staged blocks but found {len(numbered)}. "
+                f"Missing block numbers: {missing[:20]}."
+            )
+    if not numbered:
+        raise ValueError("No uncommitted blocks were found for this session.")
+
+    from azure.storage.blob import BlobBlock
+
+    return [BlobBlock(block_id=block_id) for _, block_id in numbered]
+
+
+def _block_md5(data, supplied: Optional[str] = None) -> bytes:
+    """
+    Return the MD5 digest the service should verify a block against.
+
+    A caller-supplied digest (base64, as in the Content-MD5 header) gives true
+    end-to-end validation; otherwise we hash the bytes we are about to send.
+    """
+    if supplied:
+        try:
+            digest = base64.b64decode(supplied, validate=True)
+        except (ValueError, binascii.Error) as exc:
+            raise ValueError("contentMd5 must be a base64 encoded MD5 digest.") from exc
+        if len(digest) != 16:
+            raise ValueError("contentMd5 must be a base64 encoded MD5 digest.")
+        return digest
+    return hashlib.md5(data).digest()
+
+
+def _stage_verified(blob_client, block_id: str, data, length: int, md5: bytes) -> None:
+    """Stage a block with a transactional MD5 so corruption fails the Put Block."""
+    from azure.core.exceptions import HttpResponseError
+
+    try:
+        blob_client.stage_block(
+            block_id=block_id, data=data, length=length, transactional_content_md5=md5
+        )
+    except HttpResponseError as exc:
+        if exc.error_code == "Md5Mismatch":
+            raise ValueError(
+                f"Block '{block_id}' failed MD5 validation; resend the block."
+            ) from exc
+        raise
+
+
+def _composite_md5(block_ids: List[str], md5_by_block_id: Dict[str, str]) -> Optional[str]:
+    """
+    Hash the ordered per-block MD5s into one whole-blob checksum.
+
+    Blocks may be staged in any order, so a single streaming MD5 is not
+    possible; the MD5 of the concatenated block digests (suffixed with the
+    block count) identifies the content just as well and is cheap to compute.
+    Returns None when any block's digest is unknown.
+    """
+    if not block_ids or any(block_id not in md5_by_block_id for block_id in block_ids):
+        return None
+    combined = hashlib.md5()
+    for block_id in block_ids:
+        combined.update(base64.b64decode(md5_by_block_id[block_id]))
+    return f"{combined.hexdigest()}-{len(block_ids)}"
+
+
+def _commit_metadata(payload: dict, composite_md5: Optional[str]) -> Optional[dict]:
+    metadata = payload.get("metadata")
+    if not composite_md5:
+        return metadata
+    return {**(metadata if isinstance(metadata, dict) else {}), COMPOSITE_MD5_METADATA_KEY: composite_md5}
+
+
+def _normalise_block_list(blocks) -> List["BlobBlock"]:
     if not isinstance(blocks, list) or not blocks:
         raise ValueError("blockList must be a non-empty list.")
 
+    from azure.storage.blob import BlobBlock
+
     normalised: List[BlobBlock] = []
     for block in blocks:
+        if isinstance(block, dict) and not (block.get("blockId") or block.get("id")) and "blockNumber" in block:
+            normalised.append(BlobBlock(block_id=_block_id_for_number(block["blockNumber"])))
+            continue
         block_id = block
         if isinstance(block, dict):
-            block_id = block.get("blockId") or block.get("id") or block.get("blockNumber")
+            block_id = block.get("blockId") or block.get("id")
         normalised.append(BlobBlock(block_id=_normalise_block_id(block_id)))
     return normalised
 
 
-def _content_settings_from_payload(payload: dict) -> Optional[ContentSettings]:
+def _content_settings_from_payload(payload: dict) -> "Optional[ContentSettings]":
     content_type = payload.get("contentType")
     if not content_type:
         return None
+    from azure.storage.blob import ContentSettings
+
     return ContentSettings(content_type=content_type)
 
 
+class _MemoryViewStream(io.RawIOBase):
+    """
+    Seekable, read-only stream over a slice of a memoryview.
+
+    The SDK copies bytes payloads when it trims them to length, so staging a
+    slice of a large body through this stream avoids materialising each block
+    as its own bytes object. Seeking lets the SDK rewind on retries.
+    """
+
+    def __init__(self, view: memoryview) -> None:
+        super().__init__()
+        self._view = view
+        self._position = 0
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, min(offset, len(self._view)))
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._position : self._position + len(buffer)]
+        size = len(chunk)
+        buffer[:size] = chunk
+        self._position += size
+        return size
+
+
+def _read_request(req: func.HttpRequest) -> Tuple[dict, Optional[bytes]]:
+    """
+    Return the action parameters and, for binary requests, the raw body.
+
+    JSON requests carry everything in the body. Requests sent as
+    application/octet-stream carry the block or file bytes in the body, so
+    the parameters are read from the query string, falling back to the
+    x-block-id / x-block-number / x-session-id / x-container-name /
+    x-blob-name headers.
+    """
+    content_type = (req.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+    if content_type == "application/octet-stream":
+        params = dict(req.params)
+        for header, key in BINARY_PARAM_HEADERS.items():
+            value = req.headers.get(header)
+            if value and not params.get(key):
+                params[key] = value
+        block_number = params.get("blockNumber")
+        if isinstance(block_number, str) and block_number.isdigit():
+            params["blockNumber"] = int(block_number)
+        return params, req.get_body()
+
+    body = req.get_json()
+    if not isinstance(body, dict):
+        raise ValueError("The request body must be a JSON object.")
+    return body, None
+
+
+def _get_block_size(payload: dict) -> int:
+    raw_value = payload.get("blockSize")
+    if raw_value in (None, ""):
+        return RECOMMENDED_BLOCK_SIZE
+    try:
+        block_size = int(raw_value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("blockSize must be an integer number of bytes.") from exc
+    if block_size <= 0 or block_size > MAX_BLOCK_SIZE:
+        raise ValueError(f"blockSize must be between 1 and {MAX_BLOCK_SIZE} bytes.")
+    return block_size
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def _plan_for(total_size) -> Dict[str, int]:
+    try:
+        total_size = int(total_size)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("totalSize must be an integer number of bytes.") from exc
+    return plan_upload(
+        total_size,
+        min_block_size=RECOMMENDED_BLOCK_SIZE,
+        max_block_size=MAX_BLOCK_SIZE,
+        max_blocks=MAX_BLOCKS_PER_BLOB,
+        target_blocks=ADAPTIVE_TARGET_BLOCKS,
+        initial_concurrency=INGEST_MAX_WORKERS,
+        max_concurrency=ADAPTIVE_MAX_CONCURRENCY,
+    )
+
+
+def _split_into_blocks(total_size: int, block_size: int) -> List[Tuple[int, int, int]]:
+    """Return (blockNumber, offset, length) tuples covering the source."""
+    ranges = [
+        (number, offset, min(block_size, total_size - offset))
+        for number, offset in enumerate(range(0, total_size, block_size), start=1)
+    ]
+    if len(ranges) > MAX_BLOCKS_PER_BLOB:
+        raise ValueError(
+            f"The source needs {len(ranges)} blocks of {block_size} bytes. "
+            f"Maximum supported blocks is {MAX_BLOCKS_PER_BLOB}; increase blockSize."
+        )
+    return ranges
+
+
+def _get_source_blob_client(source_url: str) -> Tuple["BlobClient", bool]:
+    """
+    Return a client for the source blob and whether the URL carries a SAS token.
+
+    SAS URLs can be read by the storage service directly, which lets us stage
+    blocks with Put Block From URL instead of pulling the bytes through the
+    function. Other URLs must live in the account behind the connection string;
+    a URL for any other account is rejected rather than read from ours.
+    """
+    parsed = urlparse(source_url)
+    if "sig" in parse_qs(parsed.query):
+        from azure.storage.blob import BlobClient
+
+        return BlobClient.from_blob_url(source_url), True
+
+    service = _get_blob_service_client()
+    # "<account>.blob.core.windows.net", or "host:port/<account>" for path-style endpoints such as Azurite.
+    account_host = service.primary_hostname.lower().rstrip("/")
+    location = f"{parsed.netloc}{parsed.path}"
+    if not location.lower().startswith(account_host + "/"):
+        raise ValueError(
+            "sourceUrl without a SAS token must point at the storage account of the configured connection string."
+        )
+    container, _, blob_path = location[len(account_host) + 1 :].partition("/")
+    if not container or not blob_path:
+        raise ValueError("sourceUrl must include a container and blob path.")
+    client = service.get_blob_client(container, unquote(blob_path))
+    return client, False
+
+
+def _stage_concurrently(
+    ranges: List[Tuple[int, int, int]],
+    stage: Callable[[str, int, int], Optional[str]],
+    max_workers: int,
+    controller: Optional[AdaptiveConcurrency] = None,
+) -> List[Dict[str, object]]:
+    """
+    Stage every range on a bounded thread pool and return the block manifest.
+
+    With a controller, the pool is sized for its maximum and each stage waits
+    for a slot, so the effective concurrency follows the controller's limit.
+    """
+    manifest: List[Dict[str, object]] = []
+    if not ranges:
+        return manifest
+
+    def _stage_one(number: int, offset: int, length: int) -> Dict[str, object]:
+        block_id = _normalise_block_id(number)
+        block = {"blockNumber": number, "blockId": block_id, "offset": offset, "size": length}
+        if controller is None:
+            content_md5 = stage(block_id, offset, length)
+        else:
+            controller.acquire()
+            started = time.perf_counter()
+            try:
+                content_md5 = stage(block_id, offset, length)
+            finally:
+                controller.release(time.perf_counter() - started, length)
+        if content_md5:
+            block["contentMd5"] = content_md5
+        return block
+
+    if controller is not None:
+        max_workers = controller.maximum
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(_stage_one, *block_range) for block_range in ranges}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    for remaining in pending:
+                        remaining.cancel()
+                    raise future.exception()
+                manifest.append(future.result())
+                if len(manifest) % INGEST_PROGRESS_EVERY == 0:
+                    logging.info("Staged %s/%s blocks.", len(manifest), len(ranges))
+
+    manifest.sort(key=lambda block: block["blockNumber"])
+    return manifest
+
+
+def _ingest(blob_client, payload: dict, raw_body: Optional[bytes]) -> dict:
+    """
+    Split a whole source into blocks, stage them in parallel and commit once.
+
+    The source is either the raw request body or the blob referenced by
+    sourceUrl. Body slices are taken through a memoryview so no block is copied
+    before it is handed to the SDK. With adaptive=true the block size comes
+    from the source size and concurrency is tuned while the blocks upload.
+    """
+    adaptive = _as_bool(payload.get("adaptive"))
+    max_workers = int(payload.get("maxConcurrency") or INGEST_MAX_WORKERS)
+    if max_workers <= 0:
+        raise ValueError("maxConcurrency must be a positive integer.")
+
+    source_url = payload.get("sourceUrl")
+    if raw_body is not None:
+        source = "body"
+        body_view = memoryview(raw_body)
+        total_size = len(body_view)
+
+        def stage(block_id: str, offset: int, length: int) -> Optional[str]:
+            block_view = body_view[offset : offset + length]
+            md5 = _block_md5(block_view)
+            _stage_verified(blob_client, block_id, _MemoryViewStream(block_view), length, md5)
+            return base64.b64encode(md5).decode()
+
+    elif source_url:
+        source = "url"
+        source_client, has_sas = _get_source_blob_client(source_url)
+        total_size = source_client.get_blob_properties().size
+
+        if has_sas:
+
+            def stage(block_id: str, offset: int, length: int) -> Optional[str]:
+                # The service copies the range itself; there are no local bytes to hash.
+                blob_client.stage_block_from_url(
+                    block_id=block_id,
+                    source_url=source_url,
+                    source_offset=offset,
+                    source_length=length,
+                )
+                return None
+
+        else:
+
+            def stage(block_id: str, offset: int, length: int) -> Optional[str]:
+                data = source_client.download_blob(
+                    offset=offset, length=length, validate_content=True
+                ).readall()
+                md5 = _block_md5(data)
+                _stage_verified(blob_client, block_id, data, length, md5)
+                return base64.b64encode(md5).decode()
+
+    else:
+        raise ValueError("ingest requires sourceUrl or an application/octet-stream body.")
+
+    controller = None
+    plan = None
+    if adaptive:
+        plan = _plan_for(total_size)
+        block_size = _get_block_size(payload) if payload.get("blockSize") else plan["blockSize"]
+        controller = AdaptiveConcurrency(
+            initial=plan["initialConcurrency"],
+            maximum=int(payload.get("maxConcurrency") or plan["maxConcurrency"]),
+        )
+    else:
+        block_size = _get_block_size(payload)
+
+    ranges = _split_into_blocks(total_size, block_size)
+    started = time.perf_counter()
+    with perf_metrics.stage("block-blob-uploader", "upload") as measurement:
+        manifest = _stage_concurrently(ranges, stage, max_workers, controller)
+        measurement.add(total_size, blocks=len(manifest))
+    composite_md5 = _composite_md5(
+        [block["blockId"] for block in manifest],
+        {block["blockId"]: block["contentMd5"] for block in manifest if "contentMd5" in block},
+    )
+    from azure.storage.blob import BlobBlock
+
+    with perf_metrics.stage("block-blob-uploader", "commit") as measurement:
+        blob_client.commit_block_list(
+            [BlobBlock(block_id=block["blockId"]) for block in manifest],
+            content_settings=_content_settings_from_payload(payload),
+            metadata=_commit_metadata(payload, composite_md5),
+        )
+        measurement.add(blocks=len(manifest))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "status": "committed",
+        "blobUrl": blob_client.url,
+        "source": source,
+        "totalBytes": total_size,
+        "blockSize": block_size,
+        "blockCount": len(manifest),
+        "concurrency": controller.summary() if controller else max_workers,
+        "plan": plan,
+        "elapsedSeconds": round(elapsed, 3),
+        "compositeMd5": composite_md5,
+        "blocks": manifest,
+    }
+
+
 @app.route(route="block-blob-uploader", methods=["POST"])
+@perf_metrics.instrument_route("block-blob-uploader")
 def block_blob_uploader(req: func.HttpRequest) -> func.HttpResponse:
     try:
-        body = req.get_json()
+        body, raw_body = _read_request(req)
     except ValueError:
         return func.HttpResponse(
             json.dumps({"error": "The request body must be valid JSON."}),
@@ -116,6 +625,17 @@ def block_blob_uploader(req: func.HttpRequest) -> func.HttpResponse:
     action = (body.get("action") or "stage").lower()
     container_name = body.get("containerName")
     blob_name = body.get("blobName")
+    session_id = body.get("sessionId")
+
+    if session_id and not (container_name and blob_name):
+        try:
+            container_name, blob_name = parse_session_id(session_id)
+        except ValueError as exc:
+            return func.HttpResponse(
+                json.dumps({"error": str(exc)}),
+                status_code=400,
+                mimetype="application/json",
+            )
 
     if not container_name or not blob_name:
         return func.HttpResponse(
@@ -124,51 +644,121 @@ def block_blob_uploader(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
+    from azure.core.exceptions import ResourceNotFoundError
+
     try:
-        blob_client = _get_blob_client(container_name, blob_name)
+        blob_client = _get_blob_client(
+            container_name, blob_name, ensure_container=action in ("start", "ingest")
+        )
         logging.info(
             "Processing '%s' action for blob '%s/%s'.", action, container_name, blob_name
         )
         if action == "start":
-            overwrite = bool(body.get("overwrite", False))
+            # Binary requests pass options as query strings, so "?overwrite=false" must stay false.
+            overwrite = _as_bool(body.get("overwrite", False))
             if overwrite:
                 try:
                     blob_client.delete_blob(delete_snapshots="include")
                 except ResourceNotFoundError:
                     pass
+            plan = None
+            if body.get("totalSize") not in (None, "") or _as_bool(body.get("adaptive")):
+                plan = _plan_for(body.get("totalSize"))
+            session_id = new_session_id(container_name, blob_name)
+            _get_session_store().create(session_id, container_name, blob_name)
             response_body = {
                 "status": "ready",
+                "sessionId": session_id,
                 "blobUrl": blob_client.url,
-                "recommendedBlockSize": RECOMMENDED_BLOCK_SIZE,
+                "recommendedBlockSize": plan["blockSize"] if plan else RECOMMENDED_BLOCK_SIZE,
                 "maxBlockSize": MAX_BLOCK_SIZE,
                 "maxBlocks": MAX_BLOCKS_PER_BLOB,
+                "plan": plan,
             }
         elif action == "stage":
-            chunk_bytes = _decode_chunk(body.get("chunkData") or body.get("data"))
-            if len(chunk_bytes) > MAX_BLOCK_SIZE:
+            if raw_body is not None:
+                # Stage straight from the request buffer; no base64 or JSON copies.
+                if not raw_body:
+                    raise ValueError("The request body must contain the block bytes.")
+                chunk_view = memoryview(raw_body)
+                chunk_size = len(chunk_view)
+                chunk_md5 = _block_md5(chunk_view, body.get("contentMd5"))
+                chunk_data = _MemoryViewStream(chunk_view)
+            else:
+                chunk_data = _decode_chunk(body.get("chunkData") or body.get("data"))
+                chunk_size = len(chunk_data)
+                chunk_md5 = _block_md5(chunk_data, body.get("contentMd5"))
+            if chunk_size > MAX_BLOCK_SIZE:
                 raise ValueError(
-                    f"Each block must be <= {MAX_BLOCK_SIZE} bytes; received {len(chunk_bytes)} bytes."
+                    f"Each block must be <= {MAX_BLOCK_SIZE} bytes; received {chunk_size} bytes."
                 )
             block_id = _get_block_id_from_payload(body)
-            blob_client.stage_block(block_id=block_id, data=chunk_bytes)
+            with perf_metrics.stage("block-blob-uploader", "upload") as measurement:
+                try:
+                    _stage_verified(blob_client, block_id, chunk_data, chunk_size, chunk_md5)
+                except ResourceNotFoundError as exc:
+                    if exc.error_code != "ContainerNotFound":
+                        raise
+                    # The caller skipped start (or the container was deleted); create it and retry once.
+                    _ensure_container(container_name, force=True)
+                    if hasattr(chunk_data, "seek"):
+                        chunk_data.seek(0)
+                    _stage_verified(blob_client, block_id, chunk_data, chunk_size, chunk_md5)
+                measurement.add(chunk_size, blocks=1)
+            chunk_md5_b64 = base64.b64encode(chunk_md5).decode()
+            block_number = _block_number_from_id(block_id)
+            if session_id and block_number is not None:
+                _get_session_store().record_block(
+                    session_id,
+                    block_number,
+                    {"blockId": block_id, "size": chunk_size, "contentMd5": chunk_md5_b64},
+                )
             response_body = {
                 "status": "staged",
                 "blockId": block_id,
-                "size": len(chunk_bytes),
+                "size": chunk_size,
+                "contentMd5": chunk_md5_b64,
+                "encoding": "binary" if raw_body is not None else "base64",
             }
         elif action == "commit":
-            block_list = _normalise_block_list(body.get("blockList") or body.get("blockIds"))
+            explicit_blocks = body.get("blockList") or body.get("blockIds")
+            if explicit_blocks is None and session_id:
+                block_list = _session_block_list(blob_client, body.get("expectedBlockCount"))
+            else:
+                block_list = _normalise_block_list(explicit_blocks)
             if len(block_list) > MAX_BLOCKS_PER_BLOB:
                 raise ValueError(
                     f"Too many blocks provided ({len(block_list)}). "
                     f"Maximum supported blocks is {MAX_BLOCKS_PER_BLOB}."
                 )
-            blob_client.commit_block_list(
-                block_list,
-                content_settings=_content_settings_from_payload(body),
-                metadata=body.get("metadata"),
-            )
-            response_body = {"status": "committed", "blobUrl": blob_client.url}
+            session = _get_session_store().load(session_id) if session_id else None
+            composite_md5 = None
+            if session:
+                composite_md5 = _composite_md5(
+                    [block.id for block in block_list],
+                    {
+                        block["blockId"]: block["contentMd5"]
+                        for block in session["blocks"].values()
+                        if block.get("contentMd5")
+                    },
+                )
+            with perf_metrics.stage("block-blob-uploader", "commit") as measurement:
+                blob_client.commit_block_list(
+                    block_list,
+                    content_settings=_content_settings_from_payload(body),
+                    metadata=_commit_metadata(body, composite_md5),
+                )
+                measurement.add(blocks=len(block_list))
+            if session_id:
+                _get_session_store().delete(session_id)
+            response_body = {
+                "status": "committed",
+                "blobUrl": blob_client.url,
+                "blockCount": len(block_list),
+                "compositeMd5": composite_md5,
+            }
+        elif action == "ingest":
+            response_body = _ingest(blob_client, body, raw_body)
         else:
             return func.HttpResponse(
                 json.dumps({"error": f"Unsupported action '{action}'."}),
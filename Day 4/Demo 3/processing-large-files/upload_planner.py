@@ -0,0 +1,129 @@
+import math
+import threading
+import time
+from typing import Dict, List
+
+MIB = 1024 * 1024
+
+
+def plan_upload(
+    total_size: int,
+    *,
+    min_block_size: int,
+    max_block_size: int,
+    max_blocks: int,
+    target_blocks: int,
+    initial_concurrency: int,
+    max_concurrency: int,
+) -> Dict[str, int]:
+    """
+    Choose a block size and starting concurrency for a declared file size.
+
+    Small files keep the minimum block size. Larger files grow the block size
+    (rounded up to whole MiB) so the upload needs about `target_blocks` round
+    trips, up to the maximum block size; beyond that the block count grows
+    towards the service limit.
+    """
+    if total_size < 0:
+        raise ValueError("totalSize must be a non-negative number of bytes.")
+
+    block_size = max(min_block_size, math.ceil(total_size / target_blocks / MIB) * MIB)
+    block_size = min(block_size, max_block_size)
+    if math.ceil(total_size / block_size) > max_blocks:
+        raise ValueError(
+            f"totalSize {total_size} exceeds the largest supported blob "
+            f"({max_block_size * max_blocks} bytes)."
+        )
+
+    block_count = math.ceil(total_size / block_size) if total_size else 0
+    return {
+        "totalSize": total_size,
+        "blockSize": block_size,
+        "blockCount": block_count,
+        "initialConcurrency": max(1, min(initial_concurrency, max_concurrency, block_count or 1)),
+        "maxConcurrency": max_concurrency,
+    }
+
+
+class AdaptiveConcurrency:
+    """
+    Hill-climbing limiter for parallel stages, driven by measured throughput.
+
+    Workers call `acquire()` before staging a block and `release()` with the
+    time it took. After each window of completed blocks (one per allowed
+    worker) the controller compares it with the previous window:
+
+    - when more than `throttle_fraction` of the blocks took longer than
+      `latency_tolerance` x the fastest block (per MiB), storage is throttling
+      (the SDK's internal retries show up as slow blocks), so the limit is
+      halved;
+    - throughput that fell by more than 10% gives back a quarter of the limit;
+    - throughput that still grows allows one more worker.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = 32,
+        latency_tolerance: float = 2.0,
+        throttle_fraction: float = 0.2,
+    ) -> None:
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.history: List[int] = [self.limit]
+        self._latency_tolerance = latency_tolerance
+        self._throttle_fraction = throttle_fraction
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._window_started = time.perf_counter()
+        self._window_bytes = 0
+        self._window_latencies: List[float] = []
+        self._last_throughput = 0.0
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, seconds: float, size: int) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._window_bytes += size
+            self._window_latencies.append(seconds / max(size / MIB, 1e-6))
+            if len(self._window_latencies) >= self.limit:
+                self._adjust()
+            self._condition.notify_all()
+
+    def _adjust(self) -> None:
+        now = time.perf_counter()
+        throughput = self._window_bytes / max(now - self._window_started, 1e-9)
+        fastest = min(self._window_latencies)
+        slow_blocks = sum(
+            1 for latency in self._window_latencies if latency > fastest * self._latency_tolerance
+        )
+
+        if slow_blocks > len(self._window_latencies) * self._throttle_fraction:
+            self.limit = max(self.minimum, self.limit // 2)
+        elif throughput < self._last_throughput * 0.9:
+            self.limit = max(self.minimum, self.limit - max(1, self.limit // 4))
+        elif throughput > self._last_throughput * 1.02:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        if self.limit != self.history[-1]:
+            self.history.append(self.limit)
+        self._last_throughput = throughput
+        self._window_started = now
+        self._window_bytes = 0
+        self._window_latencies = []
+
+    def summary(self) -> Dict[str, object]:
+        with self._condition:
+            return {
+                "final": self.limit,
+                "min": min(self.history),
+                "max": max(self.history),
+                "history": list(self.history),
+            }
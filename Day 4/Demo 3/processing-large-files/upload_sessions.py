@@ -0,0 +1,185 @@
+import base64
+import binascii
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+# Sessions that were started but never committed are dropped after this long.
+# Azure discards uncommitted blocks after 7 days, so an older manifest is useless anyway.
+UPLOAD_SESSION_TTL_SECONDS = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# Expired sessions are looked for at most this often, on create/record_block.
+PRUNE_INTERVAL_SECONDS = 60.0
+
+
+def new_session_id(container_name: str, blob_name: str) -> str:
+    """
+    Build an opaque session ID that also records the target blob.
+
+    Encoding the container and blob into the ID keeps `commit` callable with
+    just the session ID, even when it lands on a different function instance.
+    """
+    token = json.dumps({"c": container_name, "b": blob_name, "n": uuid.uuid4().hex})
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+
+
+def parse_session_id(session_id: str) -> Tuple[str, str]:
+    """Return the (container, blob) pair recorded in a session ID."""
+    padded = session_id + "=" * (-len(session_id) % 4)
+    try:
+        token = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return token["c"], token["b"]
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise ValueError("sessionId is not a valid upload session.") from exc
+
+
+class InMemorySessionStore:
+    """Process-local manifest store; enough for a single function instance."""
+
+    def __init__(self, ttl_seconds: float = UPLOAD_SESSION_TTL_SECONDS) -> None:
+        self._sessions: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._ttl_seconds = ttl_seconds
+        self._next_prune = 0.0
+
+    def _prune(self) -> None:
+        """Drop sessions older than the TTL; the caller holds the lock."""
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + min(PRUNE_INTERVAL_SECONDS, self._ttl_seconds)
+        cutoff = now - self._ttl_seconds
+        expired = [sid for sid, session in self._sessions.items() if session["createdAt"] < cutoff]
+        for session_id in expired:
+            del self._sessions[session_id]
+
+    def create(self, session_id: str, container_name: str, blob_name: str) -> dict:
+        session = {
+            "sessionId": session_id,
+            "containerName": container_name,
+            "blobName": blob_name,
+            "createdAt": time.time(),
+            "blocks": {},
+        }
+        with self._lock:
+            self._prune()
+            self._sessions[session_id] = session
+        return session
+
+    def record_block(self, session_id: str, block_number: int, block: dict) -> None:
+        with self._lock:
+            self._prune()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session["blocks"][block_number] = block
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            return {**session, "blocks": dict(session["blocks"])}
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class LocalDirectorySessionStore:
+    """
+    Manifest store that appends one JSON line per event to a file per session.
+
+    Appends of a single short line are atomic on local file systems, so
+    concurrent stages for the same session can write without coordination.
+    """
+
+    def __init__(
+        self, directory: str, ttl_seconds: float = UPLOAD_SESSION_TTL_SECONDS
+    ) -> None:
+        self._directory = directory
+        self._ttl_seconds = ttl_seconds
+        self._next_prune = 0.0
+        self._prune_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self._directory, f"{session_id}.jsonl")
+
+    def _prune(self) -> None:
+        """Delete session files whose first line (the session record) is older than the TTL."""
+        now = time.time()
+        with self._prune_lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + min(PRUNE_INTERVAL_SECONDS, self._ttl_seconds)
+        cutoff = now - self._ttl_seconds
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith(".jsonl"):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as handle:
+                    created_at = json.loads(handle.readline()).get("createdAt", 0)
+                if created_at < cutoff:
+                    os.remove(entry.path)
+            except (OSError, ValueError):
+                continue
+
+    def _append(self, session_id: str, record: dict) -> None:
+        with open(self._path(session_id), "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record) + "\n")
+
+    def create(self, session_id: str, container_name: str, blob_name: str) -> dict:
+        session = {
+            "sessionId": session_id,
+            "containerName": container_name,
+            "blobName": blob_name,
+            "createdAt": time.time(),
+        }
+        self._prune()
+        self._append(session_id, {"type": "session", **session})
+        return {**session, "blocks": {}}
+
+    def record_block(self, session_id: str, block_number: int, block: dict) -> None:
+        self._prune()
+        if os.path.exists(self._path(session_id)):
+            self._append(session_id, {"type": "block", "blockNumber": block_number, **block})
+
+    def load(self, session_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(session_id), encoding="utf-8") as handle:
+                lines = handle.readlines()
+        except FileNotFoundError:
+            return None
+
+        session: dict = {"blocks": {}}
+        for line in lines:
+            record = json.loads(line)
+            record_type = record.pop("type", None)
+            if record_type == "session":
+                session.update(record)
+            elif record_type == "block":
+                session["blocks"][record.pop("blockNumber")] = record
+        return session
+
+    def delete(self, session_id: str) -> None:
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+def build_session_store():
+    """Pick the manifest store from UPLOAD_SESSION_STORE (memory or directory)."""
+    kind = os.getenv("UPLOAD_SESSION_STORE", "memory").lower()
+    if kind == "directory":
+        return LocalDirectorySessionStore(
+            os.getenv(
+                "UPLOAD_SESSION_DIR", os.path.join(tempfile.gettempdir(), "upload-sessions")
+            )
+        )
+    if kind == "memory":
+        return InMemorySessionStore()
+    raise RuntimeError(f"Unsupported UPLOAD_SESSION_STORE '{kind}'.")
@@ -1,23 +1,66 @@
 import json
 import logging
 import os
-from io import BytesIO
-from typing import Optional
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
 import azure.functions as func
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
-from azure.storage.blob import BlobServiceClient, StandardBlobTier
-from azure.core.exceptions import ResourceNotFoundError
+
+from page_ranges import analyze_in_page_ranges
+from pdf_pipeline import StagedPipeline
+from perf_metrics import instrument_route, register_metrics_route, stage
+from processed_text import StreamingTextWriter
+from text_cache import (
+    BlobTextCache,
+    LocalDirectoryTextCache,
+    LruTextCache,
+    TieredTextCache,
+    content_key,
+)
+
+if TYPE_CHECKING:
+    # The Document Intelligence and Storage SDKs are imported on first use, keeping them off the cold-start path.
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from azure.storage.blob import BlobServiceClient
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+register_metrics_route(app)
 
-_blob_service_client: Optional[BlobServiceClient] = None
-_document_client: Optional[DocumentAnalysisClient] = None
+_blob_service_client: "Optional[BlobServiceClient]" = None
+_document_client: "Optional[DocumentAnalysisClient]" = None
+_text_cache: Optional[TieredTextCache] = None
 
 INCOMING_CONTAINER = os.getenv("INCOMING_CONTAINER", "incoming")
 PROCESSED_CONTAINER = os.getenv("PROCESSED_CONTAINER", "processed")
 ARCHIVE_CONTAINER = os.getenv("ARCHIVE_CONTAINER", "archive")
+# Documents analysed at once in batch mode.
+PDF_BATCH_CONCURRENCY = int(os.getenv("PDF_BATCH_CONCURRENCY", "4"))
+# Document Intelligence calls in flight across the process (batch documents and page ranges together);
+# keep within the Document Intelligence quota.
+PDF_ANALYZE_MAX_CALLS = int(os.getenv("PDF_ANALYZE_MAX_CALLS", str(PDF_BATCH_CONCURRENCY)))
+_analyze_slots = threading.BoundedSemaphore(PDF_ANALYZE_MAX_CALLS)
+# Worker threads for the I/O stages of the batch pipeline, and the queue depth between stages.
+PDF_STAGE_CONCURRENCY = {
+    "download": int(os.getenv("PDF_DOWNLOAD_CONCURRENCY", "4")),
+    "persist": int(os.getenv("PDF_PERSIST_CONCURRENCY", "4")),
+    "archive": int(os.getenv("PDF_ARCHIVE_CONCURRENCY", "4")),
+}
+PDF_PIPELINE_QUEUE_SIZE = int(os.getenv("PDF_PIPELINE_QUEUE_SIZE", "8"))
+# Extraction cache: "memory" (LRU only), "directory" or "blob" (LRU in front of a shared store), or "none".
+PDF_TEXT_CACHE = os.getenv("PDF_TEXT_CACHE", "memory").lower()
+PDF_TEXT_CACHE_SIZE = int(os.getenv("PDF_TEXT_CACHE_SIZE", "256"))
+# Text held by the in-process LRU, and the largest document text that is cached at all; larger documents
+# are streamed out without keeping their pages in memory.
+PDF_TEXT_CACHE_MAX_BYTES = int(float(os.getenv("PDF_TEXT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+PDF_TEXT_CACHE_MAX_ENTRY_BYTES = int(float(os.getenv("PDF_TEXT_CACHE_MAX_ENTRY_MB", "4")) * 1024 * 1024)
+# Documents with more pages than this are analysed in parallel page ranges (0 disables splitting).
+PDF_PAGE_RANGE_SIZE = int(os.getenv("PDF_PAGE_RANGE_SIZE", "0"))
+PDF_PAGE_RANGE_CONCURRENCY = int(os.getenv("PDF_PAGE_RANGE_CONCURRENCY", "4"))
+# Write <name>.pages.json next to each .txt with the byte range of every page.
+PDF_PAGE_INDEX = os.getenv("PDF_PAGE_INDEX", "false").lower() == "true"
+ARCHIVE_COPY_TIMEOUT_SECONDS = float(os.getenv("ARCHIVE_COPY_TIMEOUT_SECONDS", "300"))
+ARCHIVE_COPY_POLL_SECONDS = 1.0
 
 
 def _get_required_setting(name: str) -> str:
@@ -27,47 +70,354 @@ def _get_required_setting(name: str) -> str:
     return value
 
 
-def _get_blob_service_client() -> BlobServiceClient:
+def _get_blob_service_client() -> "BlobServiceClient":
     global _blob_service_client
     if _blob_service_client is None:
+        from azure.storage.blob import BlobServiceClient
+
         connection_string = _get_required_setting("AZURE_STORAGE_CONNECTION_STRING")
         _blob_service_client = BlobServiceClient.from_connection_string(connection_string)
     return _blob_service_client
 
 
-def _get_document_client() -> DocumentAnalysisClient:
+def _get_document_client() -> "DocumentAnalysisClient":
     global _document_client
     if _document_client is None:
         endpoint = _get_required_setting("DOCUMENT_INTELLIGENCE_ENDPOINT")
         key = _get_required_setting("DOCUMENT_INTELLIGENCE_KEY")
+        from azure.ai.formrecognizer import DocumentAnalysisClient
+        from azure.core.credentials import AzureKeyCredential
+
         _document_client = DocumentAnalysisClient(endpoint=endpoint, credential=AzureKeyCredential(key))
     return _document_client
 
 
-def _extract_text_from_pdf(pdf_data: bytes) -> str:
-    client = _get_document_client()
-    poller = client.begin_analyze_document("prebuilt-read", pdf_data)
-    result = poller.result()
-    return result.content.strip()
+def _get_text_cache() -> Optional[TieredTextCache]:
+    global _text_cache
+    if _text_cache is None and PDF_TEXT_CACHE != "none":
+        layers: List[Any] = [LruTextCache(PDF_TEXT_CACHE_SIZE, PDF_TEXT_CACHE_MAX_BYTES)]
+        if PDF_TEXT_CACHE == "directory":
+            layers.append(LocalDirectoryTextCache(_get_required_setting("PDF_TEXT_CACHE_DIR")))
+        elif PDF_TEXT_CACHE == "blob":
+            container = os.getenv("PDF_TEXT_CACHE_CONTAINER", "text-cache")
+            layers.append(BlobTextCache(_get_blob_service_client().get_container_client(container)))
+        elif PDF_TEXT_CACHE != "memory":
+            raise EnvironmentError(f"Unsupported PDF_TEXT_CACHE '{PDF_TEXT_CACHE}'.")
+        _text_cache = TieredTextCache(layers)
+    return _text_cache
+
+
+def _extract_text_from_pdf(
+    pdf_data: bytes,
+    on_page: Callable[[int, str], None],
+    document_client: "Optional[DocumentAnalysisClient]" = None,
+) -> Tuple[int, bool]:
+    """
+    Send the document text to `on_page` page by page; return (text length, cache hit).
+
+    Pages arrive in order as soon as they are available (per page range for
+    split documents), so the caller can write them out without holding the
+    whole text. Results are cached by the SHA-256 of the PDF bytes, so resent
+    or duplicate documents skip the Document Intelligence call entirely;
+    documents whose text exceeds PDF_TEXT_CACHE_MAX_ENTRY_BYTES are not cached.
+    """
+    cache = _get_text_cache()
+    length = 0
+    page_count = 0
+
+    def emit(page_number: int, text: str) -> None:
+        nonlocal length, page_count
+        length += len(text) + (1 if page_count else 0)
+        page_count += 1
+        on_page(page_number, text)
+
+    def analyze() -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        client = document_client or _get_document_client()
+        # Only kept when there is a cache to store the result in, and dropped once the text outgrows it.
+        pages: Optional[List[Tuple[int, str]]] = [] if cache else None
+        text_bytes = 0
+        for page_range in analyze_in_page_ranges(
+            client, "prebuilt-read", pdf_data, PDF_PAGE_RANGE_SIZE, PDF_PAGE_RANGE_CONCURRENCY, _analyze_slots
+        ):
+            for page_number, text in page_range:
+                emit(page_number, text)
+                if pages is not None:
+                    text_bytes += len(text.encode("utf-8"))
+                    pages.append((page_number, text))
+            if pages is not None and text_bytes > PDF_TEXT_CACHE_MAX_ENTRY_BYTES:
+                pages = None
+        if pages is None:
+            return None
+        return {
+            "pages": pages,
+            "textBytes": text_bytes,
+            "analysisSeconds": round(time.perf_counter() - started, 3),
+        }
+
+    if not cache:
+        analyze()
+        return length, False
+    entry, cache_hit = cache.get_or_compute(content_key(pdf_data), analyze)
+    if cache_hit:
+        for page_number, text in entry["pages"]:
+            emit(page_number, text)
+    return length, cache_hit
 
 
-def _upload_processed_text(blob_service: BlobServiceClient, blob_name: str, text: str) -> str:
+def _cache_stats() -> Optional[Dict[str, Any]]:
+    cache = _get_text_cache()
+    return cache.stats() if cache else None
+
+
+def _processed_text_writer(blob_service: "BlobServiceClient", blob_name: str) -> Tuple[str, StreamingTextWriter]:
     base_name = os.path.splitext(blob_name)[0]
     processed_blob_name = f"{base_name}.txt"
     processed_client = blob_service.get_blob_client(container=PROCESSED_CONTAINER, blob=processed_blob_name)
-    processed_client.upload_blob(text.encode("utf-8"), overwrite=True)
-    return processed_blob_name
+    return processed_blob_name, StreamingTextWriter(processed_client)
 
 
-def _archive_original(blob_service: BlobServiceClient, blob_name: str, pdf_data: bytes) -> None:
-    archive_client = blob_service.get_blob_client(container=ARCHIVE_CONTAINER, blob=blob_name)
-    archive_client.upload_blob(BytesIO(pdf_data), overwrite=True)
-    archive_client.set_standard_blob_tier(StandardBlobTier.Cool)
+def _finish_processed_text(
+    blob_service: "BlobServiceClient", processed_blob_name: str, writer: StreamingTextWriter
+) -> Optional[str]:
+    """Commit the text blob and, when enabled, write its page index; returns the index blob name."""
+    writer.commit()
+    if not PDF_PAGE_INDEX:
+        return None
+    index_blob_name = f"{os.path.splitext(processed_blob_name)[0]}.pages.json"
+    index = {"textBlob": processed_blob_name, **writer.page_index()}
+    index_client = blob_service.get_blob_client(container=PROCESSED_CONTAINER, blob=index_blob_name)
+    index_client.upload_blob(json.dumps(index).encode("utf-8"), overwrite=True)
+    return index_blob_name
+
+
+def _wait_for_copy(archive_client, copy_id: str, status: str) -> None:
+    deadline = time.monotonic() + ARCHIVE_COPY_TIMEOUT_SECONDS
+    while status == "pending":
+        if time.monotonic() > deadline:
+            archive_client.abort_copy(copy_id)
+            raise TimeoutError(f"Archive copy did not finish within {ARCHIVE_COPY_TIMEOUT_SECONDS} seconds.")
+        time.sleep(ARCHIVE_COPY_POLL_SECONDS)
+        copy = archive_client.get_blob_properties().copy
+        status = copy.status
+        if copy.id != copy_id:
+            raise RuntimeError("Archive blob was overwritten by another copy operation.")
+    if status != "success":
+        raise RuntimeError(f"Archive copy finished with status '{status}'.")
+
+
+def _archive_original(blob_service: "BlobServiceClient", blob_name: str) -> None:
+    """
+    Copy the original to the archive container on the Cool tier, then delete it.
+
+    The copy runs inside the storage service, so the PDF bytes are not pushed
+    back through the function. Same-account copies usually complete at once;
+    otherwise we poll until the copy succeeds before deleting the source.
+    """
+    from azure.storage.blob import StandardBlobTier
+
     incoming_client = blob_service.get_blob_client(container=INCOMING_CONTAINER, blob=blob_name)
+    archive_client = blob_service.get_blob_client(container=ARCHIVE_CONTAINER, blob=blob_name)
+    copy = archive_client.start_copy_from_url(incoming_client.url, standard_blob_tier=StandardBlobTier.Cool)
+    _wait_for_copy(archive_client, copy["copy_id"], copy["copy_status"])
     incoming_client.delete_blob(delete_snapshots="include")
 
 
+def _process_document(blob_service: "BlobServiceClient", blob_name: str) -> Optional[Dict[str, Any]]:
+    """Run the full pipeline for one blob; returns None if the blob is not in the incoming container."""
+    from azure.core.exceptions import ResourceNotFoundError
+
+    incoming_client = blob_service.get_blob_client(container=INCOMING_CONTAINER, blob=blob_name)
+    with stage("pdf_processor", "download") as measurement:
+        try:
+            pdf_data = incoming_client.download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+        measurement.add(len(pdf_data), documents=1)
+    with stage("pdf_processor", "analyze") as measurement:
+        processed_blob_name, writer = _processed_text_writer(blob_service, blob_name)
+        text_length, cache_hit = _extract_text_from_pdf(pdf_data, writer.write_page)
+        measurement.add(len(pdf_data), characters=text_length)
+    # The archive is a server-side copy, so the bytes are no longer needed.
+    del pdf_data
+    with stage("pdf_processor", "persist") as measurement:
+        page_index_blob = _finish_processed_text(blob_service, processed_blob_name, writer)
+        measurement.add(text_length)
+    with stage("pdf_processor", "archive"):
+        _archive_original(blob_service, blob_name)
+    return {
+        "blobName": blob_name,
+        "processedBlob": processed_blob_name,
+        "pageIndexBlob": page_index_blob,
+        "textLength": text_length,
+        "cacheHit": cache_hit,
+    }
+
+
+def _list_batch_blobs(blob_service: "BlobServiceClient", payload: Dict[str, Any]) -> List[str]:
+    blob_names = payload.get("blobNames")
+    if blob_names is not None:
+        if not isinstance(blob_names, list) or not all(isinstance(name, str) and name for name in blob_names):
+            raise ValueError("'blobNames' must be an array of blob names.")
+        return list(dict.fromkeys(blob_names))
+
+    prefix = payload.get("prefix") or ""
+    container_client = blob_service.get_container_client(INCOMING_CONTAINER)
+    names = [
+        blob.name
+        for blob in container_client.list_blobs(name_starts_with=prefix)
+        if blob.name.lower().endswith(".pdf")
+    ]
+    max_documents = payload.get("maxDocuments")
+    if max_documents:
+        names = names[: int(max_documents)]
+    return names
+
+
+def _build_batch_pipeline(
+    blob_service: "BlobServiceClient",
+    document_client: "Optional[DocumentAnalysisClient]",
+    analyze_concurrency: int,
+    stage_concurrency: Optional[Dict[str, int]] = None,
+    queue_size: int = PDF_PIPELINE_QUEUE_SIZE,
+) -> StagedPipeline:
+    """
+    Wire download -> analyze -> persist -> archive as a staged pipeline.
+
+    Analysis concurrency is bounded separately (by the Document Intelligence
+    quota), so downloads of the next documents and uploads of the previous
+    ones overlap with it. Both clients are parameters so the pipeline can run
+    against local fakes.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+
+    workers = {**PDF_STAGE_CONCURRENCY, **(stage_concurrency or {}), "analyze": analyze_concurrency}
+
+    def download(item: Dict[str, Any]) -> None:
+        incoming_client = blob_service.get_blob_client(container=INCOMING_CONTAINER, blob=item["blobName"])
+        with stage("pdf_processor", "download") as measurement:
+            try:
+                item["_pdf"] = incoming_client.download_blob().readall()
+            except ResourceNotFoundError:
+                item["status"] = "not_found"
+                return
+            measurement.add(len(item["_pdf"]), documents=1)
+
+    def analyze(item: Dict[str, Any]) -> None:
+        # Long documents stage their text blocks while later pages are still being analysed.
+        with stage("pdf_processor", "analyze") as measurement:
+            pdf_data = item.pop("_pdf")
+            processed_blob_name, writer = _processed_text_writer(blob_service, item["blobName"])
+            text_length, cache_hit = _extract_text_from_pdf(pdf_data, writer.write_page, document_client)
+            measurement.add(len(pdf_data), characters=text_length)
+        item.update({"_writer": writer, "textLength": text_length, "cacheHit": cache_hit})
+        item["processedBlob"] = processed_blob_name
+
+    def persist(item: Dict[str, Any]) -> None:
+        with stage("pdf_processor", "persist") as measurement:
+            page_index_blob = _finish_processed_text(blob_service, item["processedBlob"], item.pop("_writer"))
+            measurement.add(item["textLength"])
+        if page_index_blob:
+            item["pageIndexBlob"] = page_index_blob
+
+    def archive(item: Dict[str, Any]) -> None:
+        with stage("pdf_processor", "archive"):
+            _archive_original(blob_service, item["blobName"])
+        item["status"] = "processed"
+
+    return StagedPipeline(
+        [
+            ("download", download, workers["download"]),
+            ("analyze", analyze, workers["analyze"]),
+            ("persist", persist, workers["persist"]),
+            ("archive", archive, workers["archive"]),
+        ],
+        queue_size=queue_size,
+    )
+
+
+def _process_batch(
+    blob_service: "BlobServiceClient",
+    blob_names: List[str],
+    concurrency: int,
+    document_client: "Optional[DocumentAnalysisClient]" = None,
+    stage_concurrency: Optional[Dict[str, int]] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Process documents through the staged pipeline; returns (results, stage timings)."""
+    pipeline = _build_batch_pipeline(blob_service, document_client, concurrency, stage_concurrency)
+    results, timings = pipeline.run({"blobName": name} for name in blob_names)
+    for result in results:
+        result.pop("_pdf", None)
+        result.pop("_writer", None)
+    return results, timings
+
+
+def _parse_stage_concurrency(value: Any) -> Optional[Dict[str, int]]:
+    if value is None:
+        return None
+    if not isinstance(value, dict) or not set(value) <= set(PDF_STAGE_CONCURRENCY):
+        raise ValueError("'stageConcurrency' must be an object with download, persist and/or archive counts.")
+    parsed = {stage: int(count) for stage, count in value.items()}
+    if any(count <= 0 for count in parsed.values()):
+        raise ValueError("'stageConcurrency' values must be positive integers.")
+    return parsed
+
+
+def _batch_error_response(exc: Exception, correlation_id: Optional[str]) -> func.HttpResponse:
+    """Storage, credential or listing failures that stop the whole batch, not a single document."""
+    return func.HttpResponse(
+        json.dumps({"mode": "batch", "error": f"Failed to process batch: {exc}", "correlationId": correlation_id}),
+        status_code=500,
+        mimetype="application/json",
+    )
+
+
+def _handle_batch(payload: Dict[str, Any]) -> func.HttpResponse:
+    correlation_id = payload.get("correlationId")
+    try:
+        concurrency = int(payload.get("maxConcurrency") or PDF_BATCH_CONCURRENCY)
+        if concurrency <= 0:
+            raise ValueError("'maxConcurrency' must be a positive integer.")
+        stage_concurrency = _parse_stage_concurrency(payload.get("stageConcurrency"))
+        blob_service = _get_blob_service_client()
+        blob_names = _list_batch_blobs(blob_service, payload)
+    except ValueError as exc:
+        return func.HttpResponse(str(exc), status_code=400)
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.exception("Failed to list the PDF batch")
+        return _batch_error_response(exc, correlation_id)
+
+    logging.info("Processing batch of %s PDFs with concurrency %s.", len(blob_names), concurrency)
+    try:
+        results, timings = _process_batch(
+            blob_service, blob_names, concurrency, stage_concurrency=stage_concurrency
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.exception("Failed to process the PDF batch")
+        return _batch_error_response(exc, correlation_id)
+    processed = sum(1 for result in results if result["status"] == "processed")
+
+    response = {
+        "mode": "batch",
+        "requested": len(blob_names),
+        "processed": processed,
+        "failed": len(results) - processed,
+        "archiveContainer": ARCHIVE_CONTAINER,
+        "processedContainer": PROCESSED_CONTAINER,
+        "results": results,
+        "timings": timings,
+        "cache": _cache_stats(),
+        "correlationId": correlation_id,
+    }
+    return func.HttpResponse(
+        json.dumps(response),
+        status_code=200,
+        mimetype="application/json",
+    )
+
+
 @app.route(route="pdf_processor", methods=["POST"])
+@instrument_route("pdf_processor")
 def pdf_processor(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Starting PDF processing pipeline invocation.")
     try:
@@ -75,6 +425,9 @@ def pdf_processor(req: func.HttpRequest) -> func.HttpResponse:
     except ValueError:
         return func.HttpResponse("Request body must be valid JSON.", status_code=400)
 
+    if "blobNames" in payload or "prefix" in payload:
+        return _handle_batch(payload)
+
     blob_name = payload.get("blobName") or payload.get("name")
     correlation_id = payload.get("correlationId")
 
@@ -82,27 +435,25 @@ def pdf_processor(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse("The request body must include a 'blobName'.", status_code=400)
 
     blob_service = _get_blob_service_client()
-    incoming_client = blob_service.get_blob_client(container=INCOMING_CONTAINER, blob=blob_name)
 
     try:
-        pdf_data = incoming_client.download_blob().readall()
-    except ResourceNotFoundError:
-        return func.HttpResponse(f"Blob '{blob_name}' was not found in container '{INCOMING_CONTAINER}'.", status_code=404)
-
-    try:
-        extracted_text = _extract_text_from_pdf(pdf_data)
-        processed_blob_name = _upload_processed_text(blob_service, blob_name, extracted_text or " ")
-        _archive_original(blob_service, blob_name, pdf_data)
+        result = _process_document(blob_service, blob_name)
     except Exception as exc:  # pylint: disable=broad-except
         logging.exception("Failed to process blob %s", blob_name)
         return func.HttpResponse(f"Failed to process PDF: {exc}", status_code=500)
 
+    if result is None:
+        return func.HttpResponse(f"Blob '{blob_name}' was not found in container '{INCOMING_CONTAINER}'.", status_code=404)
+
     response = {
         "blobName": blob_name,
-        "processedBlob": processed_blob_name,
+        "processedBlob": result["processedBlob"],
+        "pageIndexBlob": result["pageIndexBlob"],
         "archiveContainer": ARCHIVE_CONTAINER,
         "processedContainer": PROCESSED_CONTAINER,
-        "textLength": len(extracted_text),
+        "textLength": result["textLength"],
+        "cacheHit": result["cacheHit"],
+        "cache": _cache_stats(),
         "correlationId": correlation_id,
     }
 
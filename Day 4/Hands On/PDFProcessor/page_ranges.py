@@ -0,0 +1,95 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import ContextManager, Iterator, List, Tuple
+
+# (page number, page text)
+Page = Tuple[int, str]
+
+# Page objects in an uncompressed PDF page tree; "/Type /Pages" nodes are excluded.
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+def count_pages(pdf_data: bytes) -> int:
+    """
+    Cheap page count taken from the page objects in the PDF bytes.
+
+    PDFs that keep their page tree in compressed object streams report 0;
+    callers treat that as "unknown" and analyse the document in one call.
+    """
+    return len(_PAGE_OBJECT.findall(pdf_data))
+
+
+def split_page_ranges(page_count: int, range_size: int) -> List[Tuple[int, int]]:
+    """Split pages 1..page_count into inclusive (first, last) ranges of at most range_size pages."""
+    return [
+        (first, min(first + range_size - 1, page_count))
+        for first in range(1, page_count + 1, range_size)
+    ]
+
+
+def split_pages(result, first_page: int = 1) -> List[Page]:
+    """
+    Cut an analysis result into per-page text using each page's content spans.
+
+    Results without page information are returned as a single page.
+    """
+    content = result.content
+    pages = [
+        (
+            page.page_number,
+            "".join(content[span.offset : span.offset + span.length] for span in page.spans or []).strip(),
+        )
+        for page in (getattr(result, "pages", None) or [])
+    ]
+    return pages or [(first_page, content.strip())]
+
+
+def _analyze(client, model_id: str, pdf_data: bytes, slots: ContextManager, **options):
+    # The slot is held until the result arrives: the quota counts requests in progress, not submissions.
+    with slots:
+        return client.begin_analyze_document(model_id, pdf_data, **options).result()
+
+
+def _analyze_range(
+    client, model_id: str, pdf_data: bytes, first: int, last: int, slots: ContextManager
+) -> List[Page]:
+    return split_pages(_analyze(client, model_id, pdf_data, slots, pages=f"{first}-{last}"), first)
+
+
+def analyze_in_page_ranges(
+    client,
+    model_id: str,
+    pdf_data: bytes,
+    range_size: int,
+    max_workers: int,
+    slots: ContextManager = nullcontext(),
+) -> Iterator[List[Page]]:
+    """
+    Yield the document's pages in order, one list of pages per page range.
+
+    Ranges are analysed in parallel through the `pages` option, so a long
+    document takes roughly as long as its slowest range instead of the sum of
+    all pages. Each range is yielded as soon as it and every earlier range are
+    done, which lets the caller write the output while later ranges are still
+    being analysed. Documents that fit in one range (or whose page count is
+    unknown) take a single call. Every call holds one of `slots` (a shared
+    semaphore) while it runs, so callers analysing several documents at once
+    stay within one limit.
+    """
+    page_count = count_pages(pdf_data) if range_size > 0 else 0
+    if page_count <= range_size:
+        yield split_pages(_analyze(client, model_id, pdf_data, slots))
+        return
+
+    ranges = split_page_ranges(page_count, range_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_analyze_range, client, model_id, pdf_data, first, last, slots) for first, last in ranges
+        ]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
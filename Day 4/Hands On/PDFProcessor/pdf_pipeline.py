@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Each stage receives the item's context dict and updates it in place.
+StageFunction = Callable[[Dict[str, Any]], None]
+
+_DONE = object()
+
+
+class StageTimer:
+    """Busy time per stage, so slow stages stand out in the response."""
+
+    def __init__(self, name: str, workers: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "items": self.count,
+                "totalSeconds": round(self.total, 3),
+                "avgSeconds": round(self.total / self.count, 3) if self.count else 0.0,
+                "maxSeconds": round(self.max, 3),
+            }
+
+
+class StagedPipeline:
+    """
+    Runs items through named stages connected by bounded queues.
+
+    Every stage has its own worker threads, so while one document is being
+    analysed the next one can already download and the previous one upload.
+    The bounded queues stop a fast stage from running ahead of a slow one and
+    holding too many documents in memory.
+
+    An item whose context gets a "status" (for example "not_found" or
+    "failed") skips the remaining stages but still appears in the results.
+    """
+
+    def __init__(self, stages: List[Tuple[str, StageFunction, int]], queue_size: int = 8) -> None:
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage.")
+        self._stages = stages
+        self._queue_size = queue_size
+
+    def run(self, items: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in self._stages]
+        results: "queue.Queue[Any]" = queue.Queue()
+        timers = [StageTimer(name, workers) for name, _, workers in self._stages]
+        threads: List[threading.Thread] = []
+        started = time.perf_counter()
+
+        for index, (name, function, workers) in enumerate(self._stages):
+            output = queues[index + 1] if index + 1 < len(queues) else results
+            next_workers = self._stages[index + 1][2] if index + 1 < len(self._stages) else 1
+            remaining = {"workers": workers}
+            lock = threading.Lock()
+
+            def worker(
+                source=queues[index],
+                output=output,
+                function=function,
+                timer=timers[index],
+                next_workers=next_workers,
+                remaining=remaining,
+                lock=lock,
+            ) -> None:
+                while True:
+                    item = source.get()
+                    if item is _DONE:
+                        with lock:
+                            remaining["workers"] -= 1
+                            last = remaining["workers"] == 0
+                        if last:
+                            for _ in range(next_workers):
+                                output.put(_DONE)
+                        return
+                    if "status" not in item:
+                        stage_started = time.perf_counter()
+                        try:
+                            function(item)
+                        except Exception as exc:  # pylint: disable=broad-except
+                            logging.exception("Stage '%s' failed for %s", timer.name, item.get("blobName"))
+                            item["status"] = "failed"
+                            item["error"] = str(exc)
+                            item["failedStage"] = timer.name
+                        timer.record(time.perf_counter() - stage_started)
+                    output.put(item)
+
+            for number in range(workers):
+                thread = threading.Thread(target=worker, name=f"{name}-{number}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self._stages[0][2]):
+            queues[0].put(_DONE)
+
+        collected: List[Dict[str, Any]] = []
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            collected.append(item)
+        for thread in threads:
+            thread.join()
+
+        timings = {
+            "wallSeconds": round(time.perf_counter() - started, 3),
+            "stages": [timer.summary() for timer in timers],
+        }
+        return collected, timings
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class StreamingTextWriter:
+    """
+    Writes extracted text to a block blob page by page.
+
+    Pages are separated by a newline and buffered until `block_size` bytes
+    are pending; the buffer is then staged as a block, so memory stays bounded
+    however long the document is. A document that never fills a block is
+    written with one `upload_blob` call, and `commit` otherwise only has to
+    commit the block list.
+
+    The writer also records where each page starts in the UTF-8 output, which
+    `page_index()` returns for the optional page index blob.
+    """
+
+    def __init__(self, blob_client, block_size: int = DEFAULT_BLOCK_SIZE) -> None:
+        self._blob_client = blob_client
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._block_ids: List[str] = []
+        self._pages: List[Dict[str, int]] = []
+        self.length = 0
+
+    def write_page(self, page_number: int, text: str) -> None:
+        if self._pages:
+            self._append(b"\n")
+        data = text.encode("utf-8")
+        self._pages.append({"page": page_number, "offset": self.length, "length": len(data)})
+        self._append(data)
+
+    def _append(self, data: bytes) -> None:
+        self._buffer += data
+        self.length += len(data)
+        if len(self._buffer) >= self._block_size:
+            self._stage()
+
+    def _stage(self) -> None:
+        block_id = f"{len(self._block_ids):06d}"
+        data = bytes(self._buffer)
+        self._blob_client.stage_block(block_id, data, length=len(data))
+        self._block_ids.append(block_id)
+        self._buffer.clear()
+
+    def commit(self) -> None:
+        if not self._block_ids:
+            self._blob_client.upload_blob(bytes(self._buffer) or b" ", overwrite=True)
+            return
+        if self._buffer:
+            self._stage()
+        from azure.storage.blob import BlobBlock
+
+        self._blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in self._block_ids])
+
+    def page_index(self) -> Dict[str, Any]:
+        """Byte range of every page, for consumers that fetch single pages with range reads."""
+        return {"contentLength": self.length, "pages": list(self._pages)}
+
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# A cache entry is {"pages": [[<page number>, <page text>], ...], "textBytes": <UTF-8 size of the page texts>,
+# "analysisSeconds": <time the analysis took>}.
+CacheEntry = Dict[str, Any]
+
+# Prefixed to every key; bump it whenever the entry shape changes so stored entries in the old shape are never read.
+CACHE_FORMAT_VERSION = "v2"
+
+
+def content_key(pdf_data: bytes) -> str:
+    """Content address of a document: the entry format version and the SHA-256 of its bytes."""
+    return f"{CACHE_FORMAT_VERSION}-{hashlib.sha256(pdf_data).hexdigest()}"
+
+
+class LruTextCache:
+    """In-process cache of the most recently used extraction results, bounded by entry count and text size."""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[CacheEntry, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        size = int(entry.get("textBytes", 0))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            # An entry that would push out the whole cache is left to the slower layers.
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (entry, size)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+
+class LocalDirectoryTextCache:
+    """Stores one JSON file per document hash in a local directory."""
+
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._path(key), encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        # Write then rename so concurrent readers never see a partial file.
+        temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(entry, handle)
+        os.replace(temp_path, self._path(key))
+
+
+class BlobTextCache:
+    """Stores one JSON blob per document hash, shared by every function instance."""
+
+    def __init__(self, container_client) -> None:
+        self._container = container_client
+        from azure.core.exceptions import ResourceExistsError
+
+        try:
+            self._container.create_container()
+        except ResourceExistsError:
+            pass
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            data = self._container.get_blob_client(f"{key}.json").download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+        return json.loads(data)
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        self._container.get_blob_client(f"{key}.json").upload_blob(
+            json.dumps(entry).encode("utf-8"), overwrite=True
+        )
+
+
+class TieredTextCache:
+    """
+    Looks up layers in order (fast to slow) and tracks hit statistics.
+
+    A hit in a slower layer is copied into the faster ones, and every new
+    result is written to all layers. Concurrent requests for the same key
+    are coalesced so duplicates inside one batch pay for a single analysis.
+    """
+
+    def __init__(self, layers: List[Any]) -> None:
+        self._layers = layers
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _record_hit(self, entry: CacheEntry) -> None:
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += float(entry.get("analysisSeconds", 0.0))
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        for index, layer in enumerate(self._layers):
+            entry = layer.get(key)
+            if entry is not None:
+                for faster_layer in self._layers[:index]:
+                    faster_layer.put(key, entry)
+                self._record_hit(entry)
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get_or_compute(
+        self, key: str, compute: Callable[[], Optional[CacheEntry]]
+    ) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Return (entry, cache_hit), computing and storing the entry on a miss.
+
+        `compute` may return None for a result too large to cache; nothing is
+        stored and requests waiting on the same key analyse it themselves.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry, True
+
+        with self._lock:
+            event = self._in_flight.get(key)
+            leader = event is None
+            if leader:
+                event = self._in_flight[key] = threading.Event()
+
+        if not leader:
+            event.wait()
+            entry = self._layers[0].get(key)
+            if entry is not None:
+                with self._lock:
+                    self.misses -= 1
+                self._record_hit(entry)
+                return entry, True
+            # The first request failed; try again ourselves.
+
+        try:
+            entry = compute()
+            if entry is not None:
+                self.put(key, entry)
+            return entry, False
+        finally:
+            if leader:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                event.set()
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        for layer in self._layers:
+            layer.put(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "savedSeconds": round(self.saved_seconds, 3),
+            }
@@ -2,20 +2,24 @@ import json
 import logging
 import os
 import posixpath
-from typing import Any, Dict, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
 from urllib.parse import urlparse
 
 import azure.functions as func
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import BlobServiceClient
 
 from mapping_logic.mapper import map_segments, merge_mappings
+from perf_metrics import instrument_route, register_metrics_route, stage
+
+if TYPE_CHECKING:
+    # The Storage SDK is imported on first use, keeping it off the cold-start path.
+    from azure.storage.blob import BlobServiceClient
 
 DEFAULT_ELEMENT_SEPARATOR = "*"
 DEFAULT_SEGMENT_SEPARATOR = "~"
 DEFAULT_COMPONENT_SEPARATOR = ":"
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+register_metrics_route(app)
 
 
 def detect_delimiters(x12_text: str) -> Tuple[str, str, str]:
@@ -52,7 +56,7 @@ def parse_x12(
 
 
 class BlobMappingStore:
-    def __init__(self, service: BlobServiceClient, container: str) -> None:
+    def __init__(self, service: "BlobServiceClient", container: str) -> None:
         self._service = service
         self._container = container
 
@@ -64,7 +68,9 @@ class BlobMappingStore:
         return json.loads(data)
 
 
-def _build_service_from_connection_string() -> BlobServiceClient:
+def _build_service_from_connection_string() -> "BlobServiceClient":
+    from azure.storage.blob import BlobServiceClient
+
     connection_string = os.environ.get("MAPPING_STORAGE_CONNECTION") or os.environ.get(
         "AzureWebJobsStorage"
     )
@@ -93,6 +99,8 @@ def _parse_blob_url(blob_url: str) -> Tuple[str, str, str, Optional[str]]:
 def _build_store_from_blob_url(blob_url: str) -> Tuple[BlobMappingStore, str]:
     account_url, container, blob_path, sas_token = _parse_blob_url(blob_url)
     if sas_token:
+        from azure.storage.blob import BlobServiceClient
+
         service = BlobServiceClient(account_url=account_url, credential=sas_token)
     else:
         service = _build_service_from_connection_string()
@@ -153,6 +161,7 @@ def _build_default_mapping_path(
 
 @app.function_name(name="x12-map")
 @app.route(route="x12-map", methods=["POST"])
+@instrument_route("x12-map")
 def x12_map(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("X12 mapping request received")
 
@@ -184,13 +193,17 @@ def x12_map(req: func.HttpRequest) -> func.HttpResponse:
         element_sep = payload.get("elementSeparator", detected_element)
         segment_sep = payload.get("segmentSeparator", detected_segment)
         component_sep = payload.get("componentSeparator", detected_component)
-        segments = parse_x12(x12_text, element_sep, segment_sep, component_sep)
+        with stage("x12-map", "parse") as measurement:
+            segments = parse_x12(x12_text, element_sep, segment_sep, component_sep)
+            measurement.add(len(x12_text), segments=len(segments))
 
     mapping_blob_url = payload.get("mappingBlobUrl")
     mapping_root = payload.get("mappingRoot") or os.environ.get(
         "MAPPING_ROOT", "mapping"
     )
 
+    from azure.core.exceptions import ResourceNotFoundError
+
     try:
         if mapping_blob_url:
             store, mapping_path = _build_store_from_blob_url(mapping_blob_url)
@@ -215,8 +228,11 @@ def x12_map(req: func.HttpRequest) -> func.HttpResponse:
             )
             store = _build_store_from_env(mapping_container)
 
-        mapping = load_mapping_from_store(store, mapping_path)
-        output = map_segments(segments, mapping)
+        with stage("x12-map", "download"):
+            mapping = load_mapping_from_store(store, mapping_path)
+        with stage("x12-map", "map") as measurement:
+            output = map_segments(segments, mapping)
+            measurement.add(segments=len(segments))
     except ResourceNotFoundError:
         return func.HttpResponse(
             "Mapping file not found in Blob Storage.", status_code=404
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark: a fresh TelemetryClient per invocation vs. the shared client.
+
+    python bench_telemetry_client.py [iterations]
+
+Both paths track one event with a correlation id into a channel that
+discards envelopes, so only the per-invocation client and configuration
+cost is measured. Not deployed (listed in .funcignore).
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+from applicationinsights import TelemetryClient
+from applicationinsights.channel import TelemetryChannel
+
+from telemetry_client import SharedTelemetryClient, instrumentation_key
+
+os.environ.setdefault(
+    "APPLICATIONINSIGHTS_CONNECTION_STRING",
+    "InstrumentationKey=00000000-0000-0000-0000-000000000000;"
+    "IngestionEndpoint=https://westeurope-5.in.applicationinsights.azure.com/;"
+    "LiveEndpoint=https://westeurope.livediagnostics.monitor.azure.com/",
+)
+
+
+class _DiscardQueue:
+    sender = None
+
+    def put(self, item) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+CHANNEL = TelemetryChannel(queue=_DiscardQueue())
+PROPERTIES = {"workflowName": "LA-Orders", "orderId": "PO-7781"}
+
+
+def _legacy_key():
+    ikey = os.getenv("APPINSIGHTS_INSTRUMENTATIONKEY", "").strip()
+    if ikey:
+        return ikey
+    for part in os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING", "").split(";"):
+        if part.lower().startswith("instrumentationkey="):
+            return part.split("=", 1)[1].strip() or None
+    return None
+
+
+def per_request_client(correlation_id: str) -> None:
+    client = TelemetryClient(_legacy_key(), telemetry_channel=CHANNEL)
+    client.context.operation.id = correlation_id
+    client.track_event("LogicAppEvent", properties=dict(PROPERTIES))
+
+
+SHARED = SharedTelemetryClient(instrumentation_key(), telemetry_channel=CHANNEL)
+
+
+def shared_client(correlation_id: str) -> None:
+    instrumentation_key()
+    SHARED.track_event("LogicAppEvent", properties=dict(PROPERTIES), operation_id=correlation_id)
+
+
+def _measure(fn, iterations: int):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(f"run-{i}")
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    allocated = 0
+    samples = min(iterations, 1000)
+    for i in range(samples):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn(f"run-{i}")
+        allocated += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return elapsed / iterations * 1e6, allocated / samples
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    results = {
+        "per-request client": _measure(per_request_client, iterations),
+        "shared client": _measure(shared_client, iterations),
+    }
+    for name, (micros, peak_bytes) in results.items():
+        print(f"{name:<20} {micros:8.2f} us/call {peak_bytes:10.0f} peak bytes/call")
+    legacy, shared = results["per-request client"], results["shared client"]
+    print(f"{'speed-up':<20} {legacy[0] / shared[0]:8.1f}x {legacy[1] / shared[1]:16.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,298 @@
+import atexit
 import json
 import logging
 import os
-import time
-from typing import Any, Dict, Optional
+import threading
+from numbers import Number
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 import azure.functions as func
-from applicationinsights import TelemetryClient
 
-app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+from metric_aggregator import MetricAggregator
+from perf_metrics import instrument_route, register_metrics_route, stage
+from telemetry_channel import channel_stats, get_channel
+
+if TYPE_CHECKING:
+    from telemetry_client import SharedTelemetryClient
 
+app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+register_metrics_route(app)
 
-def _extract_instrumentation_key() -> Optional[str]:
-    ikey = os.getenv("APPINSIGHTS_INSTRUMENTATIONKEY", "").strip()
-    if ikey:
-        return ikey
+# Largest number of items accepted in one bulk request.
+CUSTOM_LOGGER_MAX_BATCH = int(os.getenv("CUSTOM_LOGGER_MAX_BATCH", "5000"))
 
-    connection_string = os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING", "")
-    for part in connection_string.split(";"):
-        if part.lower().startswith("instrumentationkey="):
-            return part.split("=", 1)[1].strip() or None
+# Seconds per metric pre-aggregation window; 0 sends every metric value as it arrives.
+METRIC_AGGREGATION_WINDOW_SECONDS = float(os.getenv("METRIC_AGGREGATION_WINDOW_SECONDS", "0"))
+METRIC_AGGREGATION_PERCENTILES = [
+    float(p) for p in os.getenv("METRIC_AGGREGATION_PERCENTILES", "50,95,99").split(",") if p.strip()
+]
 
-    return None
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+ITEM_TYPES = ("event", "metric", "exception")
 
 
 def _coerce_dict(value: Any) -> Dict[str, Any]:
     return value if isinstance(value, dict) else {}
 
 
-def _build_client(correlation_id: Optional[str]) -> Optional[TelemetryClient]:
-    ikey = _extract_instrumentation_key()
-    if not ikey:
+def get_client() -> "Optional[SharedTelemetryClient]":
+    """The shared client; telemetry_client subclasses the SDK's TelemetryClient, so it is imported on first use."""
+    from telemetry_client import get_client as get_shared_client
+
+    return get_shared_client()
+
+
+def _emit_aggregates(summaries: List[Dict[str, Any]]) -> None:
+    client = get_client()
+    if not client:
+        return
+    from applicationinsights.channel.contracts import DataPointType
+
+    for summary in summaries:
+        properties = dict(summary["dimensions"])
+        properties.update({name: f"{value:g}" for name, value in summary["percentiles"].items()})
+        properties["aggregationWindowSeconds"] = f"{METRIC_AGGREGATION_WINDOW_SECONDS:g}"
+        client.track_metric(
+            summary["name"],
+            summary["sum"],
+            # Without the aggregation type the data point is a single measurement and count/min/max/stdDev are ignored.
+            type=DataPointType.aggregation,
+            count=summary["count"],
+            min=summary["min"],
+            max=summary["max"],
+            std_dev=summary["stdDev"],
+            properties=properties,
+        )
+
+
+_aggregator: Optional[MetricAggregator] = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator() -> Optional[MetricAggregator]:
+    """Process-wide metric aggregator, or None when METRIC_AGGREGATION_WINDOW_SECONDS is 0."""
+    global _aggregator
+    if METRIC_AGGREGATION_WINDOW_SECONDS <= 0:
         return None
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                # Create the channel first: atexit runs in reverse, so the last window is emitted before it closes.
+                get_channel()
+                _aggregator = MetricAggregator(
+                    METRIC_AGGREGATION_WINDOW_SECONDS, _emit_aggregates, METRIC_AGGREGATION_PERCENTILES
+                )
+                atexit.register(_aggregator.close)
+    return _aggregator
+
+
+def _fold_metrics(aggregator: MetricAggregator, event_name: str, metrics: Dict[str, Any]) -> int:
+    """Record an event's measurements in the aggregator instead of on the event; returns how many."""
+    folded = 0
+    for name, value in metrics.items():
+        if isinstance(value, Number) and not isinstance(value, bool):
+            aggregator.record(name, value, {"eventName": event_name})
+            folded += 1
+    return folded
+
+
+def _track_exception(
+    client: "SharedTelemetryClient",
+    message: str,
+    exception_type: str,
+    severity_level: Any,
+    properties: Dict[str, Any],
+    metrics: Dict[str, Any],
+    operation_id: Optional[str],
+) -> None:
+    # A copy, so the event envelope still waiting in the queue keeps its own properties.
+    properties = dict(properties)
+    properties.setdefault("exceptionType", exception_type)
+    properties.setdefault("severityLevel", str(severity_level))
+    try:
+        raise RuntimeError(message)
+    except RuntimeError:
+        client.track_exception(properties=properties, measurements=metrics, operation_id=operation_id)
+
+
+def _parse_item(raw: Any) -> Dict[str, Any]:
+    """Validate one bulk item and normalise it; raises ValueError with the reason it was rejected."""
+    if not isinstance(raw, dict):
+        raise ValueError("Item must be a JSON object.")
+
+    item_type = raw.get("type", "event")
+    if item_type not in ITEM_TYPES:
+        raise ValueError(f"type must be one of {ITEM_TYPES}.")
+
+    properties = raw.get("properties", {})
+    metrics = raw.get("metrics", {})
+    if not isinstance(properties, dict) or not isinstance(metrics, dict):
+        raise ValueError("properties and metrics must be objects.")
+    if any(not isinstance(value, Number) or isinstance(value, bool) for value in metrics.values()):
+        raise ValueError("metrics values must be numbers.")
+
+    item = {
+        "type": item_type,
+        "properties": dict(properties),
+        "metrics": metrics,
+        "correlationId": raw.get("correlationId") or raw.get("operationId"),
+        "exceptionMessage": raw.get("exceptionMessage"),
+        "exceptionType": raw.get("exceptionType", "LogicAppError"),
+        "severityLevel": raw.get("severityLevel", 3),
+    }
+    if item_type == "metric":
+        item["name"] = raw.get("name")
+        item["value"] = raw.get("value")
+        if not isinstance(item["name"], str) or not item["name"]:
+            raise ValueError("Metric items need a name.")
+        if not isinstance(item["value"], Number) or isinstance(item["value"], bool):
+            raise ValueError("Metric items need a numeric value.")
+    elif item_type == "exception":
+        if not item["exceptionMessage"]:
+            raise ValueError("Exception items need an exceptionMessage.")
+    else:
+        item["name"] = raw.get("eventName", "LogicAppEvent")
+
+    if item["correlationId"] and "correlationId" not in item["properties"]:
+        item["properties"]["correlationId"] = item["correlationId"]
+    return item
+
+
+def _track_item(client: "SharedTelemetryClient", item: Dict[str, Any]) -> None:
+    operation_id = item["correlationId"]
+    if item["type"] == "metric":
+        client.track_metric(item["name"], item["value"], properties=item["properties"], operation_id=operation_id)
+        return
+    if item["type"] == "event":
+        client.track_event(
+            item["name"], properties=item["properties"], measurements=item["metrics"], operation_id=operation_id
+        )
+    if item["exceptionMessage"]:
+        _track_exception(
+            client,
+            item["exceptionMessage"],
+            item["exceptionType"],
+            item["severityLevel"],
+            item["properties"],
+            item["metrics"],
+            operation_id,
+        )
+
+
+def _read_bulk_items(req: func.HttpRequest, payload: Any) -> List[Any]:
+    """Raw items of a bulk request; an NDJSON line that is not valid JSON becomes a ValueError item."""
+    if payload is not None:
+        return payload["events"]
+    items: List[Any] = []
+    for line_number, line in enumerate(req.get_body().splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(ValueError(f"Line {line_number} is not valid JSON."))
+    return items
+
 
-    client = TelemetryClient(ikey)
-    if correlation_id:
-        client.context.operation.id = correlation_id
-    return client
+def _log_bulk(req: func.HttpRequest, payload: Any) -> func.HttpResponse:
+    """
+    Validate every item in one pass, then enqueue all accepted telemetry with a single `put_many`.
+
+    While the items are tracked, the queue collects their envelopes instead
+    of enqueuing them, so it is locked once per request rather than once per
+    item. Each item gets its own correlation id.
+    """
+    with stage("custom-logger", "parse") as measurement:
+        raw_items = _read_bulk_items(req, payload)
+        if len(raw_items) > CUSTOM_LOGGER_MAX_BATCH:
+            return func.HttpResponse(
+                json.dumps({"error": f"At most {CUSTOM_LOGGER_MAX_BATCH} items are accepted per request."}),
+                status_code=413,
+                mimetype="application/json",
+            )
+
+        results: List[Dict[str, Any]] = []
+        parsed = []
+        for index, raw in enumerate(raw_items):
+            try:
+                if isinstance(raw, ValueError):
+                    raise raw
+                parsed.append((index, _parse_item(raw)))
+                results.append({"index": index, "status": "queued"})
+            except ValueError as exc:
+                results.append({"index": index, "status": "rejected", "error": str(exc)})
+        measurement.add(len(req.get_body()), items=len(raw_items))
+
+    client = get_client()
+    if not client:
+        logging.warning("Application Insights is not configured.")
+        return func.HttpResponse(
+            json.dumps(
+                {
+                    "status": "skipped",
+                    "reason": "Application Insights not configured",
+                    "received": len(raw_items),
+                }
+            ),
+            status_code=200,
+            mimetype="application/json",
+        )
+
+    queue = get_channel().queue
+    spans = []
+    aggregator = get_aggregator()
+    with stage("custom-logger", "enqueue") as measurement:
+        with queue.collect() as envelopes:
+            for index, item in parsed:
+                if aggregator and item["type"] == "metric":
+                    # Correlation ids are unique per run; as a dimension they would defeat the aggregation.
+                    dimensions = {k: v for k, v in item["properties"].items() if k != "correlationId"}
+                    aggregator.record(item["name"], item["value"], dimensions)
+                    results[index]["status"] = "aggregated"
+                    continue
+                if aggregator and item["type"] == "event" and item["metrics"]:
+                    _fold_metrics(aggregator, item["name"], item["metrics"])
+                    item["metrics"] = {}
+                start = len(envelopes)
+                _track_item(client, item)
+                spans.append((index, start, len(envelopes)))
+
+        accepted = queue.put_many(envelopes)
+        measurement.add(envelopes=len(envelopes))
+    for index, start, end in spans:
+        if not all(accepted[start:end]):
+            results[index]["status"] = "dropped"
+
+    counts = {
+        status: sum(1 for result in results if result["status"] == status)
+        for status in ("queued", "aggregated", "rejected", "dropped")
+    }
+    return func.HttpResponse(
+        json.dumps(
+            {
+                "status": "partial" if counts["rejected"] or counts["dropped"] else "queued",
+                "received": len(results),
+                **counts,
+                "items": results,
+                "telemetry": channel_stats(),
+                "aggregation": aggregator.stats() if aggregator else None,
+            }
+        ),
+        status_code=200,
+        mimetype="application/json",
+    )
 
 
 @app.function_name(name="custom-logger")
 @app.route(route="custom-logger", methods=["POST"])
+@instrument_route("custom-logger")
 def custom_logger(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Custom logger triggered")
 
+    content_type = req.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        return _log_bulk(req, None)
+
     try:
         payload = req.get_json()
     except ValueError:
@@ -57,6 +307,13 @@ def custom_logger(req: func.HttpRequest) -> func.HttpResponse:
             "JSON payload must be an object.", status_code=400
         )
 
+    if "events" in payload:
+        if not isinstance(payload["events"], list):
+            return func.HttpResponse(
+                "events must be an array.", status_code=400
+            )
+        return _log_bulk(req, payload)
+
     event_name = payload.get("eventName", "LogicAppEvent")
     properties = _coerce_dict(payload.get("properties"))
     metrics = _coerce_dict(payload.get("metrics"))
@@ -69,7 +326,7 @@ def custom_logger(req: func.HttpRequest) -> func.HttpResponse:
     if correlation_id and "correlationId" not in properties:
         properties["correlationId"] = correlation_id
 
-    client = _build_client(correlation_id)
+    client = get_client()
     if not client:
         logging.warning("Application Insights is not configured.")
         return func.HttpResponse(
@@ -84,28 +341,32 @@ def custom_logger(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    client.track_event(event_name, properties=properties, measurements=metrics)
+    aggregator = get_aggregator()
+    aggregated_metrics = 0
+    if aggregator and metrics:
+        aggregated_metrics = _fold_metrics(aggregator, event_name, metrics)
+        metrics = {}
 
-    tracked_exception = False
-    if exception_message:
-        properties.setdefault("exceptionType", exception_type)
-        properties.setdefault("severityLevel", str(severity_level))
-        try:
-            raise RuntimeError(exception_message)
-        except RuntimeError:
-            client.track_exception(properties=properties, measurements=metrics)
-            tracked_exception = True
+    with stage("custom-logger", "enqueue") as measurement:
+        client.track_event(event_name, properties=properties, measurements=metrics, operation_id=correlation_id)
 
-    client.flush()
-    time.sleep(0.25)
+        tracked_exception = False
+        if exception_message:
+            _track_exception(
+                client, exception_message, exception_type, severity_level, properties, metrics, correlation_id
+            )
+            tracked_exception = True
+        measurement.add(envelopes=2 if tracked_exception else 1)
 
     return func.HttpResponse(
         json.dumps(
             {
-                "status": "logged",
+                "status": "queued",
                 "eventName": event_name,
                 "trackedException": tracked_exception,
                 "correlationId": correlation_id,
+                "aggregatedMetrics": aggregated_metrics,
+                "telemetry": channel_stats(),
             }
         ),
         status_code=200,
@@ -0,0 +1,152 @@
+import logging
+import math
+import threading
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+MetricKey = Tuple[str, FrozenSet[Tuple[str, str]]]
+
+
+class QuantileSketch:
+    """
+    Count/sum/min/max plus a log-bucketed histogram for percentiles.
+
+    Values are counted in buckets whose bounds grow by a constant factor, so
+    any percentile is reported within `relative_accuracy` of the true value
+    while memory grows with the range of values, not their number.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positive: Dict[int, int] = {}
+        self._negative: Dict[int, int] = {}
+        self._zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.sum_of_squares += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self._positive[index] = self._positive.get(index, 0) + 1
+        elif value < 0:
+            index = math.ceil(math.log(-value) / self._log_gamma)
+            self._negative[index] = self._negative.get(index, 0) + 1
+        else:
+            self._zeros += 1
+
+    def _bucket_value(self, index: int) -> float:
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self._negative, reverse=True):
+            seen += self._negative[index]
+            if seen > rank:
+                return max(self.min, -self._bucket_value(index))
+        seen += self._zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self._positive):
+            seen += self._positive[index]
+            if seen > rank:
+                return min(self.max, self._bucket_value(index))
+        return self.max
+
+    def std_dev(self) -> float:
+        mean = self.sum / self.count
+        return math.sqrt(max(0.0, self.sum_of_squares / self.count - mean * mean))
+
+
+class MetricAggregator:
+    """
+    Folds measurements by (metric name, dimensions) and emits one summary per window.
+
+    `record` only updates an in-memory sketch. Every `window` seconds a
+    background thread swaps the sketches out and passes one summary per key
+    to `emit`, so a metric recorded 10,000 times in a window costs a single
+    telemetry item.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        emit: Callable[[List[Dict[str, Any]]], None],
+        percentiles: Sequence[float] = (50, 95, 99),
+        relative_accuracy: float = 0.01,
+    ) -> None:
+        self.window = window
+        self.percentiles = tuple(percentiles)
+        self._emit = emit
+        self._relative_accuracy = relative_accuracy
+        self._sketches: Dict[MetricKey, QuantileSketch] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.recorded = 0
+        self.emitted = 0
+        self._worker = threading.Thread(target=self._run, name="metric-aggregator", daemon=True)
+        self._worker.start()
+
+    def record(self, name: str, value: float, dimensions: Optional[Dict[str, Any]] = None) -> None:
+        key = (name, frozenset((str(k), str(v)) for k, v in (dimensions or {}).items()))
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = QuantileSketch(self._relative_accuracy)
+            sketch.add(value)
+            self.recorded += 1
+
+    def _summary(self, key: MetricKey, sketch: QuantileSketch) -> Dict[str, Any]:
+        name, dimensions = key
+        return {
+            "name": name,
+            "dimensions": dict(dimensions),
+            "count": sketch.count,
+            "sum": sketch.sum,
+            "min": sketch.min,
+            "max": sketch.max,
+            "stdDev": sketch.std_dev(),
+            "percentiles": {f"p{p:g}": sketch.quantile(p / 100) for p in self.percentiles},
+        }
+
+    def flush(self) -> int:
+        """Emit and reset every sketch now; returns the number of summaries emitted."""
+        with self._lock:
+            sketches, self._sketches = self._sketches, {}
+        if not sketches:
+            return 0
+        summaries = [self._summary(key, sketch) for key, sketch in sketches.items()]
+        try:
+            self._emit(summaries)
+        except Exception:
+            logging.exception("Failed to emit %s aggregated metrics.", len(summaries))
+            return 0
+        with self._lock:
+            self.emitted += len(summaries)
+        return len(summaries)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.window):
+            self.flush()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._worker.join(self.window)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "windowSeconds": self.window,
+                "series": len(self._sketches),
+                "recorded": self.recorded,
+                "emitted": self.emitted,
+            }
@@ -0,0 +1,273 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Off by default: instrument_route returns the handler unchanged and stage() is a shared no-op.
+PERF_METRICS_ENABLED = os.getenv("PERF_METRICS_ENABLED", "false").lower() == "true"
+# One JSON log line per invocation with its duration and stage timings.
+PERF_METRICS_LOG = os.getenv("PERF_METRICS_LOG", "true").lower() == "true"
+# Serve the collected percentiles on GET /api/metrics (function key required).
+PERF_METRICS_ROUTE = os.getenv("PERF_METRICS_ROUTE", "false").lower() == "true"
+
+# Histogram bucket upper bounds in milliseconds: 0.01 ms to about an hour, 5% apart.
+_BOUND_GROWTH = 1.05
+_BOUNDS: List[float] = [
+    0.01 * _BOUND_GROWTH**i for i in range(math.ceil(math.log(3.6e8) / math.log(_BOUND_GROWTH)))
+]
+
+REQUEST_STAGE = "request"
+
+
+class Histogram:
+    """
+    Latency histogram over fixed log-spaced buckets.
+
+    Recording is a bisect and an increment, memory is constant, and a
+    percentile is reported within 5% of the true value.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect_left(_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.max, _BOUNDS[index]) if index < len(_BOUNDS) else self.max
+        return self.max
+
+
+class _Series:
+    """Durations, bytes, work units (rows, segments, ...) and response codes of one route stage."""
+
+    def __init__(self) -> None:
+        self.histogram = Histogram()
+        self.bytes = 0
+        self.units: Dict[str, int] = {}
+        self.statuses: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, millis: float, nbytes: int, units: Dict[str, int], status: Optional[int] = None) -> None:
+        with self.lock:
+            self.histogram.record(millis)
+            self.bytes += nbytes
+            for unit, count in units.items():
+                self.units[unit] = self.units.get(unit, 0) + count
+            if status is not None:
+                status_class = f"{status // 100}xx"
+                self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            histogram = self.histogram
+            busy_seconds = histogram.total / 1000
+            snapshot: Dict[str, Any] = {
+                "count": histogram.count,
+                "p50Ms": round(histogram.percentile(0.5), 3),
+                "p90Ms": round(histogram.percentile(0.9), 3),
+                "p99Ms": round(histogram.percentile(0.99), 3),
+                "maxMs": round(histogram.max, 3),
+                "avgMs": round(histogram.total / histogram.count, 3) if histogram.count else 0.0,
+                "bytes": self.bytes,
+                "units": dict(self.units),
+                "perSecond": {
+                    unit: round(count / busy_seconds, 1) if busy_seconds else 0.0
+                    for unit, count in (("bytes", self.bytes), *self.units.items())
+                },
+            }
+            if self.statuses:
+                snapshot["responses"] = dict(self.statuses)
+            return snapshot
+
+
+_series: Dict[Tuple[str, str], _Series] = {}
+_series_lock = threading.Lock()
+# Stage timings of the current invocation, for its log line.
+_invocation: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "perf_invocation", default=None
+)
+
+
+def _get_series(route: str, name: str) -> _Series:
+    series = _series.get((route, name))
+    if series is None:
+        with _series_lock:
+            series = _series.setdefault((route, name), _Series())
+    return series
+
+
+class Measurement:
+    """Handed out by `stage()`; `add` attributes bytes and work units to the stage."""
+
+    __slots__ = ("bytes", "units")
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.units: Dict[str, int] = {}
+
+    def add(self, nbytes: int = 0, **units: int) -> None:
+        self.bytes += nbytes
+        for unit, count in units.items():
+            self.units[unit] = self.units.get(unit, 0) + count
+
+
+class _NoopMeasurement:
+    __slots__ = ()
+
+    def add(self, nbytes: int = 0, **units: int) -> None:
+        pass
+
+
+_NOOP_STAGE = nullcontext(_NoopMeasurement())
+
+
+@contextmanager
+def _timed_stage(route: str, name: str) -> Iterator[Measurement]:
+    measurement = Measurement()
+    started = time.perf_counter()
+    try:
+        yield measurement
+    finally:
+        millis = (time.perf_counter() - started) * 1000
+        _get_series(route, name).record(millis, measurement.bytes, measurement.units)
+        stages = _invocation.get()
+        if stages is not None:
+            stages.append((name, round(millis, 3)))
+
+
+def stage(route: str, name: str):
+    """
+    Time a stage (parse, download, map, db_write, upload, ...) of a route.
+
+        with stage("csv-processor", "parse") as measurement:
+            ...
+            measurement.add(len(data), rows=row_count)
+    """
+    if not PERF_METRICS_ENABLED:
+        return _NOOP_STAGE
+    return _timed_stage(route, name)
+
+
+def _finish_invocation(route: str, token, started: float, status: int) -> None:
+    millis = (time.perf_counter() - started) * 1000
+    stages = _invocation.get() or []
+    _invocation.reset(token)
+    _get_series(route, REQUEST_STAGE).record(millis, 0, {}, status)
+    if PERF_METRICS_LOG:
+        logging.info(
+            "perf %s",
+            json.dumps(
+                {
+                    "route": route,
+                    "status": status,
+                    "durationMs": round(millis, 3),
+                    "stages": dict(stages),
+                }
+            ),
+        )
+
+
+def instrument_route(route: str) -> Callable[[Callable], Callable]:
+    """Record the latency and response code of every invocation of an HTTP handler (sync or async)."""
+
+    def decorator(handler: Callable) -> Callable:
+        if not PERF_METRICS_ENABLED:
+            return handler
+
+        if inspect.iscoroutinefunction(handler):
+
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                token = _invocation.set([])
+                started = time.perf_counter()
+                status = 500
+                try:
+                    response = await handler(*args, **kwargs)
+                    status = getattr(response, "status_code", 200)
+                    return response
+                finally:
+                    _finish_invocation(route, token, started, status)
+
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            token = _invocation.set([])
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = handler(*args, **kwargs)
+                status = getattr(response, "status_code", 200)
+                return response
+            finally:
+                _finish_invocation(route, token, started, status)
+
+        return wrapper
+
+    return decorator
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    with _series_lock:
+        items = list(_series.items())
+    routes: Dict[str, Dict[str, Any]] = {}
+    for (route, name), series in sorted(items):
+        routes.setdefault(route, {})[name] = series.snapshot()
+    return {"enabled": PERF_METRICS_ENABLED, "routes": routes}
+
+
+def render_prometheus(snapshot: Dict[str, Any]) -> str:
+    lines = ["# TYPE function_stage_duration_ms summary"]
+    for route, stages in snapshot["routes"].items():
+        for name, values in stages.items():
+            labels = f'route="{route}",stage="{name}"'
+            for quantile, key in (("0.5", "p50Ms"), ("0.9", "p90Ms"), ("0.99", "p99Ms")):
+                lines.append(f'function_stage_duration_ms{{{labels},quantile="{quantile}"}} {values[key]}')
+            lines.append(f"function_stage_duration_ms_count{{{labels}}} {values['count']}")
+            lines.append(f"function_stage_duration_ms_sum{{{labels}}} {round(values['avgMs'] * values['count'], 3)}")
+            lines.append(f"function_stage_bytes_total{{{labels}}} {values['bytes']}")
+            for unit, count in values["units"].items():
+                lines.append(f'function_stage_units_total{{{labels},unit="{unit}"}} {count}')
+            for status_class, count in values.get("responses", {}).items():
+                lines.append(f'function_responses_total{{route="{route}",status="{status_class}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def register_metrics_route(app) -> None:
+    """Add GET /api/metrics (JSON, or Prometheus text with ?format=prometheus) when PERF_METRICS_ROUTE is on."""
+    if not (PERF_METRICS_ENABLED and PERF_METRICS_ROUTE):
+        return
+    import azure.functions as func
+
+    def perf_metrics(req: func.HttpRequest) -> func.HttpResponse:
+        snapshot = metrics_snapshot()
+        if req.params.get("format") == "prometheus":
+            return func.HttpResponse(render_prometheus(snapshot), mimetype="text/plain; version=0.0.4")
+        return func.HttpResponse(json.dumps(snapshot), status_code=200, mimetype="application/json")
+
+    app.function_name(name="perf-metrics")(
+        app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)(perf_metrics)
+    )
@@ -0,0 +1,263 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Deque, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    # applicationinsights is imported when the channel is created, keeping it off the cold-start path.
+    from applicationinsights.channel import SenderBase, TelemetryChannel
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class FakeSender:
+    """
+    Sender that keeps batches in memory instead of calling Application Insights.
+
+    `latency` simulates the round trip; with `fail=True` every batch is put
+    back on the queue, the way the real sender handles a failed request.
+    It has the `queue` and `send` parts of SenderBase the channel uses.
+    """
+
+    def __init__(self, latency: float = 0.0, fail: bool = False) -> None:
+        self.queue = None
+        self.latency = latency
+        self.fail = fail
+        self.batches: List[List[Dict[str, Any]]] = []
+
+    def send(self, data_to_send) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail:
+            for data in data_to_send:
+                self.queue.put(data)
+            return
+        self.batches.append([envelope.write() for envelope in data_to_send])
+
+
+class BatchingQueue:
+    """
+    Bounded in-memory queue drained by a background thread.
+
+    `put` only appends an envelope, so tracking telemetry costs the request
+    no network I/O. The worker sends a batch as soon as `batch_size`
+    envelopes are waiting, or every `flush_interval` seconds otherwise.
+    When the queue is full, `overflow_policy` decides what is lost:
+    "drop_oldest" evicts the oldest envelope, "drop_newest" rejects the new
+    one, and "block" waits up to `block_timeout` seconds for room before
+    rejecting it. Envelopes the sender puts back after a failed request go
+    to the front of the queue and are retried on the next interval.
+    """
+
+    def __init__(
+        self,
+        sender: "SenderBase",
+        max_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        overflow_policy: str = "drop_oldest",
+        block_timeout: float = 0.05,
+    ) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported overflow policy '{overflow_policy}'; use one of {OVERFLOW_POLICIES}.")
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self._sender = sender
+        self._sender.queue = self
+        self._items: Deque[Any] = deque()
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._closed = False
+        self._in_flight = 0
+        self._local = threading.local()
+        self.enqueued = 0
+        self.dropped = 0
+        self.requeued = 0
+        self.sent = 0
+        self.batches = 0
+        self._worker = threading.Thread(target=self._run, name="telemetry-sender", daemon=True)
+        self._worker.start()
+
+    @property
+    def sender(self) -> "SenderBase":
+        return self._sender
+
+    def put(self, item) -> bool:
+        """Enqueue an envelope; returns False when the overflow policy dropped it."""
+        if not item:
+            return False
+        if threading.current_thread() is self._worker:
+            return self._requeue(item)
+        collected = getattr(self._local, "collected", None)
+        if collected is not None:
+            collected.append(item)
+            return True
+        return self.put_many([item])[0]
+
+    @contextmanager
+    def collect(self) -> Iterator[List[Any]]:
+        """Divert this thread's puts into a list, so the caller can enqueue them with one `put_many`."""
+        collected: List[Any] = []
+        self._local.collected = collected
+        try:
+            yield collected
+        finally:
+            self._local.collected = None
+
+    def put_many(self, items: List[Any]) -> List[bool]:
+        """Enqueue envelopes under one lock; returns, per envelope, whether it was accepted."""
+        with self._cond:
+            deadline = time.monotonic() + self.block_timeout
+            accepted = [self._append(item, deadline) for item in items]
+            if len(self._items) >= self.batch_size:
+                self._cond.notify_all()
+        return accepted
+
+    def _append(self, item, deadline: float) -> bool:
+        if len(self._items) >= self.max_size:
+            if self.overflow_policy == "drop_oldest":
+                self._items.popleft()
+                self.dropped += 1
+            elif self.overflow_policy == "block":
+                self._cond.notify_all()
+                self._cond.wait_for(
+                    lambda: len(self._items) < self.max_size, max(0.0, deadline - time.monotonic())
+                )
+            if len(self._items) >= self.max_size:
+                self.dropped += 1
+                return False
+        self._items.append(item)
+        self.enqueued += 1
+        return True
+
+    def _requeue(self, item) -> bool:
+        with self._cond:
+            if self._closed or len(self._items) >= self.max_size:
+                self.dropped += 1
+                return False
+            self._items.appendleft(item)
+            self.requeued += 1
+        return True
+
+    def flush(self) -> None:
+        """Ask the worker to send what is queued now; does not wait for it."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+
+    def drain(self, timeout: float = 5.0) -> bool:
+        """Flush and wait until the queue is empty and no batch is in flight."""
+        self.flush()
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._items and not self._in_flight, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def _next_batch(self, back_off: bool) -> List[Any]:
+        with self._cond:
+            if back_off:
+                # Wait a full interval instead of retrying a failing endpoint in a tight loop.
+                self._cond.wait_for(lambda: self._closed, self.flush_interval)
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._items) < self.batch_size and not self._flush_requested and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._items.popleft() for _ in range(min(self.batch_size, len(self._items)))]
+            if not self._items:
+                self._flush_requested = False
+            self._in_flight = len(batch)
+            self._cond.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        back_off = False
+        while True:
+            batch = self._next_batch(back_off)
+            if not batch:
+                if self._closed:
+                    return
+                continue
+
+            requeued_before = self.requeued
+            try:
+                self._sender.send(batch)
+                failed = 0
+            except Exception:
+                logging.exception("Dropping a telemetry batch of %s items after a sender error.", len(batch))
+                failed = len(batch)
+            with self._cond:
+                requeued = self.requeued - requeued_before
+                self.dropped += failed
+                self.sent += len(batch) - requeued - failed
+                self.batches += 1
+                self._in_flight = 0
+                self._cond.notify_all()
+            back_off = bool(requeued)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": len(self._items),
+                "maxSize": self.max_size,
+                "overflowPolicy": self.overflow_policy,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "requeued": self.requeued,
+                "sent": self.sent,
+                "batches": self.batches,
+            }
+
+
+_channel: "Optional[TelemetryChannel]" = None
+_channel_lock = threading.Lock()
+
+
+def _build_sender() -> "SenderBase":
+    if os.getenv("TELEMETRY_SENDER", "http").lower() == "fake":
+        return FakeSender(latency=float(os.getenv("TELEMETRY_FAKE_LATENCY_SECONDS", "0")))
+    from applicationinsights.channel import SynchronousSender
+
+    sender = SynchronousSender()
+    sender.send_timeout = float(os.getenv("TELEMETRY_SEND_TIMEOUT_SECONDS", "10"))
+    return sender
+
+
+def get_channel() -> "TelemetryChannel":
+    """Create the channel on first use from the TELEMETRY_* settings and share it for the life of the worker."""
+    global _channel
+    if _channel is None:
+        with _channel_lock:
+            if _channel is None:
+                from applicationinsights.channel import TelemetryChannel
+
+                queue = BatchingQueue(
+                    _build_sender(),
+                    max_size=int(os.getenv("TELEMETRY_QUEUE_MAX_SIZE", "10000")),
+                    batch_size=int(os.getenv("TELEMETRY_BATCH_SIZE", "100")),
+                    flush_interval=float(os.getenv("TELEMETRY_FLUSH_INTERVAL_SECONDS", "2")),
+                    overflow_policy=os.getenv("TELEMETRY_OVERFLOW_POLICY", "drop_oldest").lower(),
+                    block_timeout=float(os.getenv("TELEMETRY_BLOCK_TIMEOUT_SECONDS", "0.05")),
+                )
+                # Send what is left when the worker process shuts down.
+                atexit.register(queue.close)
+                _channel = TelemetryChannel(queue=queue)
+    return _channel
+
+
+def channel_stats() -> Optional[Dict[str, Any]]:
+    """Metrics of the channel's queue, or None when it has not been created yet."""
+    return _channel.queue.stats() if _channel else None
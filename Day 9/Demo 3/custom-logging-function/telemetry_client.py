@@ -0,0 +1,112 @@
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Optional
+
+from applicationinsights import TelemetryClient
+from applicationinsights.channel import contracts
+
+from telemetry_channel import get_channel
+
+
+@lru_cache(maxsize=1)
+def _parse_instrumentation_key(ikey_setting: str, connection_string: str) -> Optional[str]:
+    ikey = ikey_setting.strip()
+    if ikey:
+        return ikey
+
+    for part in connection_string.split(";"):
+        if part.lower().startswith("instrumentationkey="):
+            return part.split("=", 1)[1].strip() or None
+
+    return None
+
+
+def instrumentation_key() -> Optional[str]:
+    """
+    Instrumentation key from APPINSIGHTS_INSTRUMENTATIONKEY or the connection string.
+
+    The raw settings are the cache key, so the connection string is parsed
+    once and again only after a setting changes.
+    """
+    return _parse_instrumentation_key(
+        os.getenv("APPINSIGHTS_INSTRUMENTATIONKEY", ""),
+        os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING", ""),
+    )
+
+
+class OperationContext:
+    """
+    The per-call part of a telemetry context: instrumentation key and operation id.
+
+    The channel's own TelemetryContext supplies the device, cloud and SDK
+    tags, so a call needs none of the objects (and `platform`/`locale`
+    lookups) a full TelemetryContext builds.
+    """
+
+    __slots__ = ("instrumentation_key", "operation")
+
+    device = cloud = application = user = session = location = None
+    properties = None
+
+    def __init__(self, instrumentation_key: str, operation_id: Optional[str]) -> None:
+        self.instrumentation_key = instrumentation_key
+        self.operation = contracts.Operation()
+        self.operation.id = operation_id
+
+
+class _OperationView:
+    """Stands in for the client inside TelemetryClient's track_* methods, routing them to one call's context."""
+
+    __slots__ = ("_client", "_context")
+
+    def __init__(self, client: TelemetryClient, context: OperationContext) -> None:
+        self._client = client
+        self._context = context
+
+    def track(self, data, context) -> None:
+        self._client.track(data, context)
+
+
+class SharedTelemetryClient(TelemetryClient):
+    """
+    One TelemetryClient for every invocation.
+
+    Correlation is a per-call `operation_id` argument instead of state on the
+    client, so concurrent invocations can share it without racing on
+    `context.operation.id`.
+    """
+
+    def _for(self, operation_id: Optional[str]):
+        if not operation_id:
+            return self
+        return _OperationView(self, OperationContext(self.context.instrumentation_key, operation_id))
+
+    def track_event(self, name, properties=None, measurements=None, operation_id: Optional[str] = None) -> None:
+        TelemetryClient.track_event(self._for(operation_id), name, properties, measurements)
+
+    def track_metric(self, name, value, operation_id: Optional[str] = None, **kwargs: Any) -> None:
+        TelemetryClient.track_metric(self._for(operation_id), name, value, **kwargs)
+
+    def track_exception(self, properties=None, measurements=None, operation_id: Optional[str] = None) -> None:
+        # Called from an except block; TelemetryClient reads the exception from sys.exc_info().
+        TelemetryClient.track_exception(self._for(operation_id), properties=properties, measurements=measurements)
+
+
+_client: Optional[SharedTelemetryClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Optional[SharedTelemetryClient]:
+    """Process-wide client on the shared channel; rebuilt when the instrumentation key changes, None if unset."""
+    global _client
+    ikey = instrumentation_key()
+    if not ikey:
+        return None
+    client = _client
+    if client is None or client.context.instrumentation_key != ikey:
+        with _client_lock:
+            if _client is None or _client.context.instrumentation_key != ikey:
+                _client = SharedTelemetryClient(ikey, telemetry_channel=get_channel())
+            client = _client
+    return client
@@ -0,0 +1,503 @@
+"""
+In-memory stand-ins for the Azure services the function apps call.
+
+- InMemoryBlobService: Blob Storage (containers, block blobs, server-side copy)
+- FakeDocumentAnalysisClient: Document Intelligence "prebuilt-read"
+- FakePostgres: psycopg2 connections that record statements instead of sending them
+
+Each stand-in takes a ServiceModel, which adds latency and throttling: a
+request costs a fixed latency plus its share of a bandwidth split between
+in-flight requests. At most `capacity` requests are served at once; one that
+finds no free slot waits `throttle_penalty` seconds and tries again, which
+is how the SDK's retry of a 503/429 looks to the caller. Application
+Insights needs no stand-in here: custom-logger ships FakeSender
+(TELEMETRY_SENDER=fake).
+"""
+
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+
+try:
+    from psycopg2 import errors, extensions
+except ImportError:  # Only FakePostgres needs psycopg2.
+    errors = extensions = None
+
+
+class ServiceModel:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        capacity: int = 0,
+        throttle_penalty: float = 0.25,
+    ) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.capacity = capacity
+        self.throttle_penalty = throttle_penalty
+        self.requests = 0
+        self.throttled = 0
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(capacity) if capacity else None
+
+    def request(self, size: int = 0, extra: float = 0.0) -> None:
+        """Block for the simulated duration of one request moving `size` bytes."""
+        with self._lock:
+            self.requests += 1
+        if self._slots is not None:
+            while not self._slots.acquire(blocking=False):
+                with self._lock:
+                    self.throttled += 1
+                time.sleep(self.throttle_penalty)
+        try:
+            with self._lock:
+                self._in_flight += 1
+                in_flight = self._in_flight
+                self.peak_in_flight = max(self.peak_in_flight, in_flight)
+            delay = self.latency + extra
+            if self.bandwidth:
+                delay += size * in_flight / self.bandwidth
+            if delay:
+                time.sleep(delay)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "throttled": self.throttled, "peakInFlight": self.peak_in_flight}
+
+
+class _Blob:
+    __slots__ = ("data", "blocks", "metadata", "tier")
+
+    def __init__(self) -> None:
+        self.data: Optional[bytes] = None
+        self.blocks: Dict[str, bytes] = {}
+        self.metadata: Optional[dict] = None
+        self.tier = None
+
+
+class _Download:
+    def __init__(self, data: bytes, chunk_size: int = 4 * 1024 * 1024) -> None:
+        self._data = data
+        self._chunk_size = chunk_size
+
+    def readall(self) -> bytes:
+        return self._data
+
+    def chunks(self) -> Iterator[bytes]:
+        for offset in range(0, len(self._data), self._chunk_size):
+            yield self._data[offset : offset + self._chunk_size]
+
+
+class _Properties:
+    def __init__(self, size: int, copy=None) -> None:
+        self.size = size
+        self.copy = copy
+
+
+class _CopyProperties:
+    def __init__(self, copy_id: str, status: str) -> None:
+        self.id = copy_id
+        self.status = status
+
+
+class InMemoryBlobClient:
+    def __init__(self, service: "InMemoryBlobService", container: str, blob: str) -> None:
+        self._service = service
+        self.container_name = container
+        self.blob_name = blob
+        self.url = f"{service.url}/{container}/{blob}"
+
+    def _existing(self) -> _Blob:
+        blob = self._service.find(self.container_name, self.blob_name)
+        if blob is None or blob.data is None:
+            error = ResourceNotFoundError("The specified blob does not exist.")
+            error.error_code = "BlobNotFound"
+            raise error
+        return blob
+
+    def download_blob(self, offset: Optional[int] = None, length: Optional[int] = None, **kwargs) -> _Download:
+        data = self._existing().data
+        if offset is not None:
+            data = data[offset : offset + length if length is not None else None]
+        self._service.model.request(len(data))
+        return _Download(data)
+
+    def get_blob_properties(self, **kwargs) -> _Properties:
+        self._service.model.request()
+        blob = self._existing()
+        return _Properties(len(blob.data), _CopyProperties("copy-0", "success"))
+
+    def upload_blob(self, data, overwrite: bool = False, metadata: Optional[dict] = None, **kwargs) -> None:
+        content = data.read() if hasattr(data, "read") else bytes(data)
+        self._service.model.request(len(content))
+        blob = self._service.blob(self.container_name, self.blob_name)
+        with self._service.lock:
+            if blob.data is not None and not overwrite:
+                raise ResourceExistsError("The specified blob already exists.")
+            blob.data = content
+            blob.metadata = metadata
+            blob.tier = kwargs.get("standard_blob_tier")
+
+    def stage_block(self, block_id: str, data, length: Optional[int] = None, **kwargs) -> None:
+        content = data.read() if hasattr(data, "read") else bytes(data)
+        self._service.model.request(len(content))
+        expected_md5 = kwargs.get("transactional_content_md5")
+        if expected_md5 and hashlib.md5(content).digest() != expected_md5:
+            error = HttpResponseError(message="The MD5 value specified did not match.")
+            error.error_code = "Md5Mismatch"
+            raise error
+        blob = self._service.blob(self.container_name, self.blob_name)
+        with self._service.lock:
+            blob.blocks[block_id] = content
+
+    def stage_block_from_url(self, block_id: str, source_url: str, source_offset: int = 0,
+                             source_length: Optional[int] = None, **kwargs) -> None:
+        self._service.model.request()
+        source = self._service.client_from_url(source_url)._existing().data
+        end = source_offset + source_length if source_length is not None else None
+        blob = self._service.blob(self.container_name, self.blob_name)
+        with self._service.lock:
+            blob.blocks[block_id] = source[source_offset:end]
+
+    def get_block_list(self, block_list_type: str = "committed", **kwargs):
+        self._service.model.request()
+        blob = self._service.blob(self.container_name, self.blob_name)
+        with self._service.lock:
+            uncommitted = [self._block(block_id, len(data)) for block_id, data in blob.blocks.items()]
+        return [], uncommitted if block_list_type in ("uncommitted", "all") else []
+
+    def commit_block_list(self, block_list, content_settings=None, metadata=None, **kwargs) -> None:
+        self._service.model.request()
+        blob = self._service.blob(self.container_name, self.blob_name)
+        with self._service.lock:
+            parts = []
+            for block in block_list:
+                block_id = block.id if hasattr(block, "id") else block
+                if block_id not in blob.blocks:
+                    raise HttpResponseError(message=f"Block '{block_id}' is not staged.")
+                parts.append(blob.blocks[block_id])
+            blob.data = b"".join(parts)
+            blob.blocks = {}
+            blob.metadata = metadata
+
+    def start_copy_from_url(self, source_url: str, standard_blob_tier=None, **kwargs) -> Dict[str, str]:
+        self._service.model.request()
+        source = self._service.client_from_url(source_url)._existing()
+        blob = self._service.blob(self.container_name, self.blob_name)
+        with self._service.lock:
+            blob.data = source.data
+            blob.tier = standard_blob_tier
+        return {"copy_id": "copy-0", "copy_status": "success"}
+
+    def abort_copy(self, copy_id: str, **kwargs) -> None:
+        self._service.model.request()
+
+    def delete_blob(self, **kwargs) -> None:
+        self._service.model.request()
+        self._existing()
+        self._service.remove(self.container_name, self.blob_name)
+
+    @staticmethod
+    def _block(block_id: str, size: int) -> BlobBlock:
+        block = BlobBlock(block_id=block_id)
+        block.size = size
+        return block
+
+
+class _BlobItem:
+    def __init__(self, name: str, size: int) -> None:
+        self.name = name
+        self.size = size
+
+
+class InMemoryContainerClient:
+    def __init__(self, service: "InMemoryBlobService", container: str) -> None:
+        self._service = service
+        self.container_name = container
+
+    def create_container(self, **kwargs) -> None:
+        self._service.model.request()
+        with self._service.lock:
+            if self.container_name in self._service.containers:
+                raise ResourceExistsError("The specified container already exists.")
+            self._service.containers[self.container_name] = {}
+
+    def list_blobs(self, name_starts_with: Optional[str] = None, **kwargs) -> List[_BlobItem]:
+        self._service.model.request()
+        prefix = name_starts_with or ""
+        with self._service.lock:
+            blobs = self._service.containers.get(self.container_name, {})
+            return [
+                _BlobItem(name, len(blob.data))
+                for name, blob in sorted(blobs.items())
+                if name.startswith(prefix) and blob.data is not None
+            ]
+
+    def get_blob_client(self, blob: str) -> InMemoryBlobClient:
+        return InMemoryBlobClient(self._service, self.container_name, blob)
+
+
+class InMemoryBlobService:
+    """Stands in for BlobServiceClient; every blob operation goes through `model`."""
+
+    def __init__(self, model: Optional[ServiceModel] = None, url: str = "https://loadtest.blob.core.windows.net") -> None:
+        self.model = model or ServiceModel()
+        self.url = url
+        # As on BlobServiceClient: the account host, plus the account path for path-style endpoints.
+        parsed = urlparse(url)
+        self.primary_hostname = f"{parsed.netloc}{parsed.path}".rstrip("/")
+        self.containers: Dict[str, Dict[str, _Blob]] = {}
+        self.lock = threading.Lock()
+
+    def get_blob_client(self, container: str, blob: str, **kwargs) -> InMemoryBlobClient:
+        return InMemoryBlobClient(self, container, blob)
+
+    def get_container_client(self, container: str) -> InMemoryContainerClient:
+        return InMemoryContainerClient(self, container)
+
+    def client_from_url(self, blob_url: str) -> InMemoryBlobClient:
+        """The blob a URL (SAS or not) points at, for code that builds clients with from_blob_url."""
+        container, _, blob = urlparse(blob_url).path.lstrip("/").partition("/")
+        return InMemoryBlobClient(self, container, unquote(blob))
+
+    def blob(self, container: str, name: str) -> _Blob:
+        with self.lock:
+            # Like the service, writes to a missing container fail; loads seed containers with put().
+            if container not in self.containers:
+                error = ResourceNotFoundError("The specified container does not exist.")
+                error.error_code = "ContainerNotFound"
+                raise error
+            return self.containers[container].setdefault(name, _Blob())
+
+    def find(self, container: str, name: str) -> Optional[_Blob]:
+        with self.lock:
+            return self.containers.get(container, {}).get(name)
+
+    def remove(self, container: str, name: str) -> None:
+        with self.lock:
+            self.containers.get(container, {}).pop(name, None)
+
+    def put(self, container: str, name: str, data: bytes) -> None:
+        """Seed a blob without simulated latency."""
+        with self.lock:
+            blob = self.containers.setdefault(container, {}).setdefault(name, _Blob())
+            blob.data = data
+
+
+class _Span:
+    def __init__(self, offset: int, length: int) -> None:
+        self.offset = offset
+        self.length = length
+
+
+class _Page:
+    def __init__(self, page_number: int, span: _Span) -> None:
+        self.page_number = page_number
+        self.spans = [span]
+
+
+class _AnalyzeResult:
+    def __init__(self, content: str, pages: List[_Page]) -> None:
+        self.content = content
+        self.pages = pages
+
+
+class _Poller:
+    def __init__(self, client: "FakeDocumentAnalysisClient", pages: List[int]) -> None:
+        self._client = client
+        self._pages = pages
+
+    def result(self) -> _AnalyzeResult:
+        self._client.model.request(extra=self._client.page_latency * len(self._pages))
+        content = ""
+        pages = []
+        for page_number in self._pages:
+            text = f"Page {page_number}. " + self._client.page_text
+            pages.append(_Page(page_number, _Span(len(content), len(text))))
+            content += text + "\n"
+        return _AnalyzeResult(content, pages)
+
+
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+class FakeDocumentAnalysisClient:
+    """
+    Stands in for DocumentAnalysisClient: a call costs the model latency plus `page_latency` per page.
+
+    Page numbers come from the "/Type /Page" objects in the bytes, as in
+    page_ranges.count_pages, so make_pdf() documents split like real ones.
+    """
+
+    def __init__(self, model: Optional[ServiceModel] = None, page_latency: float = 0.0,
+                 page_text: str = "Lorem ipsum dolor sit amet. " * 40) -> None:
+        self.model = model or ServiceModel()
+        self.page_latency = page_latency
+        self.page_text = page_text
+
+    def begin_analyze_document(self, model_id: str, document, pages: Optional[str] = None, **kwargs) -> _Poller:
+        data = document.read() if hasattr(document, "read") else document
+        if pages:
+            first, _, last = pages.partition("-")
+            numbers = list(range(int(first), int(last or first) + 1))
+        else:
+            numbers = list(range(1, max(1, len(_PAGE_OBJECT.findall(data))) + 1))
+        return _Poller(self, numbers)
+
+
+def make_pdf(pages: int, salt: str = "") -> bytes:
+    """Bytes with `pages` page objects; `salt` makes documents distinct so caches keyed on content miss."""
+    body = b"".join(b"%d 0 obj << /Type /Page >> endobj\n" % (number + 3) for number in range(pages))
+    return b"%PDF-1.4\n%" + salt.encode() + b"\n1 0 obj << /Type /Pages >> endobj\n" + body + b"%%EOF\n"
+
+
+class _ConnectionInfo:
+    def __init__(self, connection: "FakeConnection") -> None:
+        self._connection = connection
+
+    @property
+    def transaction_status(self) -> int:
+        return self._connection.status
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakeConnection") -> None:
+        self.connection = connection
+        self.rowcount = -1
+
+    def _statement(self, sql, rows: int = 1, size: int = 0) -> None:
+        self.connection.database.record(sql, rows, size)
+        self.connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.rowcount = rows
+
+    def execute(self, sql, params=None) -> None:
+        text = sql.decode() if isinstance(sql, bytes) else str(sql)
+        # execute_values sends "INSERT ... VALUES (...),(...)"; count the row tuples it rendered.
+        rows = text.count("),(") + 1 if " VALUES " in text.upper() else 1
+        self._statement(text, rows, len(text))
+
+    def mogrify(self, template, args) -> bytes:
+        return ("(" + ",".join(repr(value) for value in args) + ")").encode()
+
+    def copy_expert(self, sql, file, size: int = 8192) -> None:
+        rows = 0
+        total = 0
+        while True:
+            try:
+                chunk = file.read(size)
+            except Exception as exc:
+                # psycopg2 ends the COPY with an error and raises what the server answers, not the read() error.
+                raise errors.QueryCanceled(f"COPY from stdin failed: error in .read() call: {exc!r}") from None
+            if not chunk:
+                break
+            rows += chunk.count(b"\n")
+            total += len(chunk)
+        self._statement(sql, rows, total)
+
+    def callproc(self, name: str, params=None) -> None:
+        self._statement(f"CALL {name}", 1, sum(len(str(param)) for param in params or ()))
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class FakeConnection:
+    encoding = "UTF8"
+
+    def __init__(self, database: "FakePostgres") -> None:
+        self.database = database
+        self.closed = 0
+        self.autocommit = False
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.info = _ConnectionInfo(self)
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def _end(self, counter: str) -> None:
+        self.database.model.request()
+        with self.database.lock:
+            self.database.counts[counter] += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self) -> None:
+        self._end("commits")
+
+    def rollback(self) -> None:
+        self._end("rollbacks")
+
+    def get_transaction_status(self) -> int:
+        return self.status
+
+    def close(self) -> None:
+        self.closed = 1
+
+    def __enter__(self) -> "FakeConnection":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class FakePostgres:
+    """
+    psycopg2.connect replacement whose statements cost `model` latency plus `row_latency` per row.
+
+    install() patches psycopg2.connect (which psycopg2.pool calls too), so
+    pg_pool.py and bulk_insert.py run unchanged against it.
+    """
+
+    def __init__(self, model: Optional[ServiceModel] = None, row_latency: float = 0.0) -> None:
+        self.model = model or ServiceModel()
+        self.row_latency = row_latency
+        self.lock = threading.Lock()
+        self.counts = {"connections": 0, "statements": 0, "rows": 0, "bytes": 0, "commits": 0, "rollbacks": 0}
+        self.statements: List[Tuple[str, int]] = []
+        self.keep_statements = 0
+
+    def connect(self, *args, **kwargs) -> FakeConnection:
+        self.model.request()
+        with self.lock:
+            self.counts["connections"] += 1
+        return FakeConnection(self)
+
+    def record(self, sql: str, rows: int, size: int) -> None:
+        self.model.request(size, extra=self.row_latency * rows)
+        with self.lock:
+            self.counts["statements"] += 1
+            self.counts["rows"] += rows
+            self.counts["bytes"] += size
+            if len(self.statements) < self.keep_statements:
+                self.statements.append((sql[:80], rows))
+
+    def install(self) -> None:
+        import psycopg2
+
+        psycopg2.connect = self.connect
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.counts, **self.model.stats()}
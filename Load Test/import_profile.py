@@ -0,0 +1,147 @@
+"""
+Profile what each function app imports at cold start, and fail on regressions.
+
+    python import_profile.py
+    python import_profile.py --apps "Day 3/Demo 2" --top 10 --json
+
+Every app in import_budget.json is imported in a fresh interpreter with
+`python -X importtime`, the way the Python worker indexes function_app.py.
+azure.functions is imported first and left out of the figures, because the
+worker has it loaded before the app. The report gives the import time the
+app adds (the median over `--repeat` runs) and the packages that cost most.
+
+The exit code is 1 when an app imports a module its budget lists under
+"forbidden" (the SDKs the apps load on first use), or when its import time
+exceeds "maxMs".
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BUDGET = Path(__file__).resolve().parent / "import_budget.json"
+
+# Runs in the app folder and prints the modules the app added to the ones the worker already has.
+# -X importtime also lists failed optional imports (e.g. `nt` on Linux); only modules that loaded are counted.
+_CHILD = (
+    "import json, sys; import azure.functions; preloaded = set(sys.modules); import function_app; "
+    "print(json.dumps(sorted(set(sys.modules) - preloaded)))"
+)
+
+
+def _package(module: str) -> str:
+    """Group azure.* modules by their second component and everything else by its top-level package."""
+    parts = module.split(".")
+    return ".".join(parts[:2]) if parts[0] == "azure" else parts[0]
+
+
+def _matches(module: str, prefixes: List[str]) -> Optional[str]:
+    for prefix in prefixes:
+        if module == prefix or module.startswith(prefix + "."):
+            return prefix
+    return None
+
+
+def profile_once(app_dir: Path, env: Dict[str, str]) -> Tuple[float, Dict[str, float]]:
+    """Import the app once; returns (total ms added by the app, self ms per imported module)."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD],
+        cwd=app_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {app_dir} failed:\n{completed.stderr[-2000:]}")
+
+    loaded = set(json.loads(completed.stdout.splitlines()[-1]))
+    modules: Dict[str, float] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if not self_us.strip().isdigit() or name not in loaded:
+            continue
+        modules[name] = modules.get(name, 0.0) + int(self_us) / 1000
+    return sum(modules.values()), modules
+
+
+def profile_app(app_dir: Path, repeat: int, env: Dict[str, str]) -> Dict[str, Any]:
+    # The first run compiles the app's bytecode; later runs load it from the cache, as a deployed app does.
+    profile_once(app_dir, env)
+    runs = sorted((profile_once(app_dir, env) for _ in range(repeat)), key=lambda run: run[0])
+    total, modules = runs[len(runs) // 2]
+
+    packages: Dict[str, float] = {}
+    for name, millis in modules.items():
+        packages[_package(name)] = packages.get(_package(name), 0.0) + millis
+    return {
+        "importMs": round(total, 2),
+        "fastestMs": round(runs[0][0], 2),
+        "slowestMs": round(runs[-1][0], 2),
+        "stdevMs": round(statistics.pstdev(run[0] for run in runs), 2),
+        "modules": len(modules),
+        "packages": {
+            name: round(millis, 2) for name, millis in sorted(packages.items(), key=lambda item: -item[1])
+        },
+        "imported": sorted(modules),
+    }
+
+
+def check_budget(result: Dict[str, Any], budget: Dict[str, Any]) -> List[str]:
+    problems = []
+    forbidden = budget.get("forbidden", [])
+    found = sorted({prefix for name in result["imported"] if (prefix := _matches(name, forbidden))})
+    if found:
+        problems.append(f"imports {', '.join(found)} at cold start")
+    if budget.get("maxMs") is not None and result["importMs"] > budget["maxMs"]:
+        problems.append(f"import takes {result['importMs']:.1f} ms (budget {budget['maxMs']} ms)")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure and check the cold-start imports of the function apps.")
+    parser.add_argument("--budget", type=Path, default=DEFAULT_BUDGET, help="Apps and their import budgets.")
+    parser.add_argument("--apps", nargs="*", help="App folders to profile (default: every app in the budget).")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed imports per app; the median is reported.")
+    parser.add_argument("--top", type=int, default=5, help="Packages listed per app.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args(argv)
+
+    budgets: Dict[str, Dict[str, Any]] = json.loads(args.budget.read_text())["apps"]
+    apps = args.apps or list(budgets)
+
+    failures = 0
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Keep bytecode out of the app folders.
+        env = {**os.environ, "PYTHONPYCACHEPREFIX": cache_dir, "PYTHONDONTWRITEBYTECODE": ""}
+        for app in apps:
+            result = profile_app(REPO_ROOT / app, max(1, args.repeat), env)
+            result["problems"] = check_budget(result, budgets.get(app, {}))
+            failures += bool(result["problems"])
+            results[app] = result
+            if args.json:
+                continue
+            top = ", ".join(f"{name} {millis:.1f}" for name, millis in list(result["packages"].items())[: args.top])
+            status = "FAIL " + "; ".join(result["problems"]) if result["problems"] else "ok"
+            print(f"{app:<40} {result['importMs']:8.1f} ms  {status}")
+            print(f"{'':<40} top: {top}")
+
+    if args.json:
+        for result in results.values():
+            del result["imported"]
+        print(json.dumps(results, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,476 @@
+"""
+Load-test the function apps' HTTP handlers locally against in-memory Azure stand-ins.
+
+    python load_test.py --requests 500 --concurrency 16
+    python load_test.py --routes x12-map pdf_processor --concurrency 1 4 16 --storage-latency-ms 10
+
+Each route's real function_app.py is imported and its handler is called
+with constructed func.HttpRequest objects from a thread pool, the way the
+Python worker runs synchronous functions. Blob Storage, Document
+Intelligence and PostgreSQL are replaced with the stand-ins in fakes.py;
+custom-logger uses its own FakeSender. The report gives throughput and
+p50/p95/p99/max latency per route and concurrency level.
+"""
+
+import argparse
+import asyncio
+import csv
+import importlib.util
+import inspect
+import io
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import azure.functions as func
+
+from fakes import FakeDocumentAnalysisClient, FakePostgres, InMemoryBlobService, ServiceModel, make_pdf
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Route -> (app folder, function name).
+APPS = {
+    "x12-map": ("Day 7/Demo 5/x12-mapping-function", "x12-map"),
+    "csv-processor": ("Day 4/Demo 2/csv_processor", "csv-processor"),
+    "block-blob-uploader": ("Day 4/Demo 3/processing-large-files", "block_blob_uploader"),
+    "block-blob-from-url": ("Day 4/Demo 3/processing-large-files", "block_blob_uploader"),
+    "pdf_processor": ("Day 4/Hands On/PDFProcessor", "pdf_processor"),
+    "custom-logger": ("Day 9/Demo 3/custom-logging-function", "custom-logger"),
+    "transaction-demo": ("Day 3/Demo 2", "transaction-demo"),
+}
+
+
+# Loaded app module name -> (app folder, the sibling modules it imported from there).
+_APP_IMPORTS: Dict[str, Tuple[str, Dict[str, ModuleType]]] = {}
+
+
+@contextmanager
+def _app_folder(app_dir: str, modules: Dict[str, ModuleType]) -> Iterator[None]:
+    before = set(sys.modules)
+    sys.modules.update(modules)
+    sys.path.insert(0, app_dir)
+    try:
+        yield
+    finally:
+        sys.path.remove(app_dir)
+        for name in set(sys.modules) - before:
+            if (getattr(sys.modules[name], "__file__", None) or "").startswith(app_dir):
+                modules[name] = sys.modules.pop(name)
+
+
+def load_app(route: str):
+    """
+    Import a route's function_app.py under its own module name.
+
+    The apps share sibling module names (function_app, pg_pool,
+    perf_metrics, ...), so the modules an app imported from its folder are
+    dropped from sys.modules afterwards; the next app then gets its own
+    copies while this one keeps references to the modules it was built with.
+    """
+    app_dir = str(REPO_ROOT / APPS[route][0])
+    modules: Dict[str, ModuleType] = {}
+    with _app_folder(app_dir, modules):
+        spec = importlib.util.spec_from_file_location(
+            f"function_app_{route.replace('-', '_')}", os.path.join(app_dir, "function_app.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    _APP_IMPORTS[module.__name__] = (app_dir, modules)
+    return module
+
+
+def app_imports(module) -> Iterator[None]:
+    """
+    Put a loaded app's folder and sibling modules back while its handler runs.
+
+    The apps import some modules on first use rather than at cold start
+    (telemetry_client, for example), so those imports must resolve against
+    the app's own folder during the run too.
+    """
+    return _app_folder(*_APP_IMPORTS[module.__name__])
+
+
+def get_handler(module, function_name: str) -> Callable:
+    for function in module.app.get_functions():
+        if function.get_function_name() == function_name:
+            return function.get_user_function()
+    raise LookupError(f"{module.__name__} has no function named '{function_name}'.")
+
+
+def _json_request(route: str, body: Any, params: Optional[Dict[str, str]] = None) -> func.HttpRequest:
+    return func.HttpRequest(
+        method="POST",
+        url=f"/api/{route}",
+        headers={"Content-Type": "application/json"},
+        params=params or {},
+        body=json.dumps(body).encode(),
+    )
+
+
+class Scenario:
+    """
+    One route wired to its stand-ins.
+
+    `prepare(i)` seeds whatever request `i` needs (not timed) and returns
+    the request; `stats()` reports what the stand-ins saw.
+    """
+
+    route = ""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.module = self.setup()
+        self.handler = get_handler(self.module, APPS[self.route][1])
+
+    def setup(self):
+        raise NotImplementedError
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+def _storage(args: argparse.Namespace) -> InMemoryBlobService:
+    return InMemoryBlobService(
+        ServiceModel(
+            latency=args.storage_latency_ms / 1000,
+            bandwidth=args.storage_bandwidth_mbps * 1024 * 1024,
+            capacity=args.storage_capacity,
+            throttle_penalty=args.throttle_penalty_ms / 1000,
+        )
+    )
+
+
+class X12MapScenario(Scenario):
+    route = "x12-map"
+
+    def setup(self):
+        self.storage = _storage(self.args)
+        mapping_root = REPO_ROOT / "Mapping Logic"
+        for path in (mapping_root / "mapping").rglob("*.json"):
+            self.storage.put("x12-mappings", path.relative_to(mapping_root).as_posix(), path.read_bytes())
+        self.x12 = (mapping_root / "samples" / "850_acme.edi").read_text()
+        module = load_app(self.route)
+        module._build_service_from_connection_string = lambda: self.storage
+        return module
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        return _json_request(self.route, {"x12": self.x12, "client": "acme", "transactionSet": "850"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"storage": self.storage.model.stats()}
+
+
+class CsvProcessorScenario(Scenario):
+    route = "csv-processor"
+    blob_url = "https://loadtest.blob.core.windows.net/csv/orders.csv?sv=2024-01-01&sig=loadtest"
+
+    def setup(self):
+        self.storage = _storage(self.args)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["orderId", "customer", "amount"])
+        for row in range(self.args.csv_rows):
+            writer.writerow([f"PO-{row}", f"customer-{row % 97}", f"{row * 1.5:.2f}"])
+        self.storage.put("csv", "orders.csv", buffer.getvalue().encode())
+        module = load_app(self.route)
+        module._build_blob_client = self.storage.client_from_url
+        return module
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        return _json_request(self.route, {"blobUrl": self.blob_url})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"storage": self.storage.model.stats()}
+
+
+class BlockBlobUploaderScenario(Scenario):
+    route = "block-blob-uploader"
+
+    def setup(self):
+        self.storage = _storage(self.args)
+        self.body = os.urandom(self.args.upload_kb * 1024)
+        module = load_app(self.route)
+        module._blob_service_client = self.storage
+        return module
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        return func.HttpRequest(
+            method="POST",
+            url=f"/api/{self.route}",
+            headers={"Content-Type": "application/octet-stream"},
+            params={
+                "action": "ingest",
+                "containerName": "uploads",
+                "blobName": f"load/{index}.bin",
+                "blockSize": str(self.args.upload_block_kb * 1024),
+            },
+            body=self.body,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"storage": self.storage.model.stats()}
+
+
+class BlockBlobUploaderUrlScenario(BlockBlobUploaderScenario):
+    """`ingest` from a sourceUrl in the same account, without a SAS token: the function reads the source itself."""
+
+    route = "block-blob-from-url"
+
+    def setup(self):
+        module = super().setup()
+        self.storage.put("sources", "upload.bin", self.body)
+        return module
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        return _json_request(
+            self.route,
+            {
+                "action": "ingest",
+                "containerName": "uploads",
+                "blobName": f"load/url-{index}.bin",
+                "sourceUrl": f"{self.storage.url}/sources/upload.bin",
+                "blockSize": self.args.upload_block_kb * 1024,
+            },
+        )
+
+
+class PdfProcessorScenario(Scenario):
+    route = "pdf_processor"
+
+    def setup(self):
+        self.storage = _storage(self.args)
+        for container in ("incoming", "processed", "archive"):
+            self.storage.put(container, ".keep", b"")
+        self.analyzer = FakeDocumentAnalysisClient(
+            ServiceModel(latency=self.args.analyze_latency_ms / 1000, capacity=self.args.analyze_capacity,
+                         throttle_penalty=self.args.throttle_penalty_ms / 1000),
+            page_latency=self.args.analyze_page_latency_ms / 1000,
+        )
+        module = load_app(self.route)
+        module._blob_service_client = self.storage
+        module._document_client = self.analyzer
+        self.documents = count()
+        return module
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        # Distinct bytes for every request of every run, so the extraction cache does not hide the analyzer.
+        document = next(self.documents)
+        self.storage.put("incoming", f"load/{document}.pdf", make_pdf(self.args.pdf_pages, salt=str(document)))
+        return _json_request(self.route, {"blobName": f"load/{document}.pdf"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"storage": self.storage.model.stats(), "analyzer": self.analyzer.model.stats()}
+
+
+class CustomLoggerScenario(Scenario):
+    route = "custom-logger"
+
+    def setup(self):
+        os.environ.setdefault("APPINSIGHTS_INSTRUMENTATIONKEY", "00000000-0000-0000-0000-000000000000")
+        os.environ["TELEMETRY_SENDER"] = "fake"
+        os.environ["TELEMETRY_FAKE_LATENCY_SECONDS"] = str(self.args.telemetry_latency_ms / 1000)
+        return load_app(self.route)
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        events = [
+            {
+                "type": "event",
+                "name": "LogicAppStep",
+                "correlationId": f"run-{index}",
+                "properties": {"step": str(step)},
+                "metrics": {"durationMs": step * 3.5},
+            }
+            for step in range(self.args.events_per_request)
+        ]
+        return _json_request(self.route, {"events": events})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"telemetry": self.module.channel_stats()}
+
+
+class TransactionDemoScenario(Scenario):
+    route = "transaction-demo"
+
+    def setup(self):
+        for name, value in (("PG_HOST", "loadtest"), ("PG_DB", "loadtest"), ("PG_USER", "loadtest"),
+                            ("PG_PASSWORD", "loadtest")):
+            os.environ.setdefault(name, value)
+        self.database = FakePostgres(
+            ServiceModel(latency=self.args.db_latency_ms / 1000, capacity=self.args.db_capacity,
+                         throttle_penalty=self.args.throttle_penalty_ms / 1000),
+            row_latency=self.args.db_row_latency_us / 1e6,
+        )
+        self.database.install()
+        return load_app(self.route)
+
+    def prepare(self, index: int) -> func.HttpRequest:
+        records = [
+            {"email": f"user{index}-{row}@example.com", "message": f"load test {row}"}
+            for row in range(self.args.db_rows)
+        ]
+        return _json_request(self.route, {"records": records})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"database": self.database.stats()}
+
+
+SCENARIOS = {
+    scenario.route: scenario
+    for scenario in (
+        X12MapScenario,
+        CsvProcessorScenario,
+        BlockBlobUploaderScenario,
+        BlockBlobUploaderUrlScenario,
+        PdfProcessorScenario,
+        CustomLoggerScenario,
+        TransactionDemoScenario,
+    )
+}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def _invoke(handler: Callable, request: func.HttpRequest):
+    response = handler(request)
+    if inspect.isawaitable(response):
+        response = asyncio.run(response)
+    return response
+
+
+def run_load(scenario: Scenario, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    """Send `requests` requests with at most `concurrency` in flight; returns throughput and latency."""
+    for index in range(warmup):
+        _invoke(scenario.handler, scenario.prepare(-1 - index))
+
+    indexes = count()
+    index_lock = threading.Lock()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    results_lock = threading.Lock()
+
+    def worker() -> None:
+        while True:
+            with index_lock:
+                index = next(indexes)
+            if index >= requests:
+                return
+            request = scenario.prepare(index)
+            started = time.perf_counter()
+            try:
+                status = _invoke(scenario.handler, request).status_code
+            except Exception:  # noqa: BLE001 - an unhandled error is a 500 from the host
+                logging.exception("Request %s to %s raised.", index, scenario.route)
+                status = 500
+            millis = (time.perf_counter() - started) * 1000
+            with results_lock:
+                latencies.append(millis)
+                status_class = f"{status // 100}xx"
+                statuses[status_class] = statuses.get(status_class, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "route": scenario.route,
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "requestsPerSecond": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50Ms": round(_percentile(latencies, 0.5), 2),
+        "p95Ms": round(_percentile(latencies, 0.95), 2),
+        "p99Ms": round(_percentile(latencies, 0.99), 2),
+        "maxMs": round(latencies[-1], 2) if latencies else 0.0,
+        "responses": statuses,
+    }
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    errors = sum(count for status, count in result["responses"].items() if status != "2xx")
+    print(
+        f"{result['route']:<20} c={result['concurrency']:<4} n={result['requests']:<6} "
+        f"{result['requestsPerSecond']:9.1f} req/s  p50={result['p50Ms']:8.2f}ms "
+        f"p95={result['p95Ms']:8.2f}ms p99={result['p99Ms']:8.2f}ms max={result['maxMs']:8.2f}ms "
+        f"errors={errors}"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load-test the function apps against in-memory Azure stand-ins.")
+    parser.add_argument("--routes", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route and concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests sent before each route.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the handlers' INFO logging.")
+
+    storage = parser.add_argument_group("Blob Storage")
+    storage.add_argument("--storage-latency-ms", type=float, default=5.0)
+    storage.add_argument("--storage-bandwidth-mbps", type=float, default=200.0)
+    storage.add_argument("--storage-capacity", type=int, default=64, help="In-flight requests before throttling.")
+    storage.add_argument("--throttle-penalty-ms", type=float, default=250.0)
+
+    workloads = parser.add_argument_group("Workloads")
+    workloads.add_argument("--csv-rows", type=int, default=1000)
+    workloads.add_argument("--upload-kb", type=int, default=4096)
+    workloads.add_argument("--upload-block-kb", type=int, default=1024)
+    workloads.add_argument("--pdf-pages", type=int, default=4)
+    workloads.add_argument("--events-per-request", type=int, default=20)
+    workloads.add_argument("--db-rows", type=int, default=100)
+
+    services = parser.add_argument_group("Document Intelligence, PostgreSQL, Application Insights")
+    services.add_argument("--analyze-latency-ms", type=float, default=150.0)
+    services.add_argument("--analyze-page-latency-ms", type=float, default=20.0)
+    services.add_argument("--analyze-capacity", type=int, default=15, help="Concurrent analyses before throttling.")
+    services.add_argument("--db-latency-ms", type=float, default=2.0, help="Round trip per statement and commit.")
+    services.add_argument("--db-row-latency-us", type=float, default=5.0)
+    services.add_argument("--db-capacity", type=int, default=0, help="Concurrent statements (0 = unlimited).")
+    services.add_argument("--telemetry-latency-ms", type=float, default=50.0, help="Per batch sent by the channel.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        # The handlers log per row/request; at INFO that cost dominates the measurement.
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for route in args.routes:
+        scenario = SCENARIOS[route](args)
+        with app_imports(scenario.module):
+            for concurrency in args.concurrency:
+                result = run_load(scenario, args.requests, concurrency, args.warmup)
+                results.append(result)
+                if not args.json:
+                    _print_result(result)
+            stats = scenario.stats()
+        if args.json:
+            results.append({"route": route, "standIns": stats})
+        else:
+            print(f"{'':<20} stand-ins: {json.dumps(stats)}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()